@@ -1,45 +1,357 @@
+import time
+_import_started = time.time()
+
 from flask import Flask, request, jsonify, render_template_string, render_template, Response
 from PIL import Image
-import requests
-from io import BytesIO
 import torch
-import clip
-import time
-import threading
+import heapq
 import json
-import ssl
+import os
+import numpy as np
 from playwright.sync_api import sync_playwright
-from scraper import scrape_us_tommy
-from scraper_shopify import scrape_shopify_url, scrape_bouldergear_womens
+from scraper import browser_pool_stats
+from scraper_registry import default_registry
+from scrape_cache import ScrapeCache
 from improved_matcher import (
-    get_multi_scale_embeddings,
-    compute_advanced_similarity,
+    PREPROCESS_VERSION,
+    ALL_VIEWS,
+    ORIGINAL_VIEW,
+    DETAIL_VIEWS,
+    get_multi_scale_embeddings_batch,
+    iter_multi_scale_embeddings,
+    compute_advanced_similarity_batch,
+    cascade_recall,
     rerank_with_diversity
 )
+from embedding_catalog import EmbeddingCatalog, catalog_key
+from catalog_sync import refresh_shopify_collection
+from jobs import JobRegistry, JobWorkerPool, QueueFull
+from image_downloader import ImageDownloader
+from image_cache import ImageCache
+from inference_backends import load_backend, load_clip_model, check_accuracy, reference_images
+from inference_scheduler import InferenceScheduler, PRIORITY_QUERY, PRIORITY_BULK
 
 # ---------------------------
 # Setup CLIP
 # ---------------------------
-# Handle SSL certificate issues for CLIP model download
-ssl._create_default_https_context = ssl._create_unverified_context
+CLIP_MODEL_NAME = "ViT-B/32"
+# Local, pinned weights file (e.g. a copy of ViT-B-32.pt); when set, startup needs no network access
+CLIP_WEIGHTS = os.environ.get("CLIP_WEIGHTS")
+# Where downloaded weights are cached (clip's default when unset)
+CLIP_DOWNLOAD_ROOT = os.environ.get("CLIP_DOWNLOAD_ROOT")
+
+# Seconds spent in each startup phase, reported by /startup_stats
+startup_timings = {"import": round(time.time() - _import_started, 2)}
+
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
 print(f"Loading CLIP model on device: {device}")
-model, preprocess = clip.load("ViT-B/32", device=device)
-print("✅ CLIP model loaded successfully")
+_weights_started = time.time()
+model, preprocess = load_clip_model(CLIP_MODEL_NAME, device, weights=CLIP_WEIGHTS, download_root=CLIP_DOWNLOAD_ROOT)
+model.eval()
+startup_timings["weights"] = round(time.time() - _weights_started, 2)
+print(f"✅ CLIP model loaded successfully in {startup_timings['weights']}s")
+
+# Image encoder backend: fp32 (eager), int8 (dynamic quantization), torchscript or onnx
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "fp32")
+_backend_started = time.time()
+try:
+    # torchscript/onnx are traced or exported in warmup(), after gunicorn forks the
+    # workers, so the preloading master never runs the model
+    image_encoder = load_backend(INFERENCE_BACKEND, model, device, CLIP_MODEL_NAME, defer=True)
+except RuntimeError as e:
+    print(f"⚠️ {INFERENCE_BACKEND} backend unavailable ({e}), falling back to fp32")
+    image_encoder = load_backend("fp32", model, device, CLIP_MODEL_NAME)
+startup_timings["backend"] = round(time.time() - _backend_started, 2)
+
+# Number of image views encoded per CLIP forward pass
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", 32))
+
+# All encoding goes through one scheduler thread that batches images across jobs;
+# query images are served before bulk catalog embedding
+inference = InferenceScheduler(
+    image_encoder,
+    max_batch_size=EMBED_BATCH_SIZE,
+    max_wait_ms=float(os.environ.get("INFERENCE_MAX_WAIT_MS", 10)),
+    torch_threads=int(os.environ.get("INFERENCE_THREADS", 0)) or None
+)
+query_encoder = inference.client(PRIORITY_QUERY)
+catalog_encoder = inference.client(PRIORITY_BULK)
+
+
+def warmup():
+    """
+    Run a dummy batch through the image encoder so the first search does not
+    pay for lazy initialization (allocator, kernel selection, graph optimization).
+
+    Called once per serving process before it takes traffic: from gunicorn's
+    post_worker_init hook, after the fork, since torch's thread pools do not
+    survive a fork. Deferred backends (torchscript, onnx) are built here too.
+    """
+    started = time.time()
+    image_encoder.build()
+    startup_timings["backend"] = round(startup_timings["backend"] + time.time() - started, 2)
+    started = time.time()
+    dummy = preprocess(Image.new("RGB", (224, 224))).unsqueeze(0).to(device)
+    with torch.no_grad():
+        image_encoder.encode_image(dummy.repeat(EMBED_BATCH_SIZE, 1, 1, 1))
+        image_encoder.encode_image(dummy)
+    if image_encoder.name != "fp32" and os.environ.get("INFERENCE_ACCURACY_CHECK") == "1":
+        accuracy = check_accuracy(model, image_encoder, reference_images(), preprocess, device)
+        print(f"📊 {image_encoder.name} vs fp32: {accuracy}")
+    startup_timings["warmup"] = round(time.time() - started, 2)
+    print(
+        f"🔥 Ready: import {startup_timings['import']}s, weights {startup_timings['weights']}s, "
+        f"backend {startup_timings['backend']}s, warmup {startup_timings['warmup']}s"
+    )
+
+# First-stage vector index settings: catalogs above ANN_MIN_PRODUCTS are narrowed
+# to ANN_CANDIDATES products before multi-scale scoring
+ANN_INDEX_KIND = os.environ.get("ANN_INDEX_KIND", "ivf")
+ANN_MIN_PRODUCTS = int(os.environ.get("ANN_MIN_PRODUCTS", 2000))
+ANN_CANDIDATES = int(os.environ.get("ANN_CANDIDATES", 500))
+
+# Cascade mode: when products still need embedding, rank all of them by the original view
+# only and compute the center-crop and contrast views for the best CASCADE_CANDIDATES (0 = off)
+CASCADE_CANDIDATES = int(os.environ.get("CASCADE_CANDIDATES", 0))
+# Random products per cascade search that also get all views, to estimate the first stage's recall
+CASCADE_RECALL_SAMPLE = int(os.environ.get("CASCADE_RECALL_SAMPLE", 0))
+
+# Diversity re-ranking: "names" (shared words in product names) or "mmr" (embedding
+# similarity to already selected results, plus RERANK_NAME_WEIGHT times the name overlap)
+RERANK_METHOD = os.environ.get("RERANK_METHOD", "names")
+RERANK_NAME_WEIGHT = float(os.environ.get("RERANK_NAME_WEIGHT", 0.0))
+
+# Downscaled copies of product images, revalidated with ETag/Last-Modified once older than max_age
+image_cache = ImageCache(
+    root=os.environ.get("IMAGE_CACHE_DIR", "image_cache"),
+    max_bytes=int(os.environ.get("IMAGE_CACHE_MAX_MB", 1024)) * 1024 * 1024,
+    max_age=int(os.environ.get("IMAGE_CACHE_MAX_AGE", 24 * 3600))
+)
+
+# Shared pooled downloader for product images
+image_downloader = ImageDownloader(
+    max_workers=int(os.environ.get("DOWNLOAD_WORKERS", 16)),
+    per_host_limit=int(os.environ.get("DOWNLOAD_PER_HOST", 8)),
+    cache=image_cache
+)
+
+# Picks the cheapest scraper (Shopify JSON, sitemap, static HTML, browser) per store;
+# Shopify searches fetch at most SHOPIFY_MAX_PRODUCTS products (0 for no limit)
+scrapers = default_registry(shopify_max_products=int(os.environ.get("SHOPIFY_MAX_PRODUCTS", 50)) or None)
+
+# Scrape results shared between searches; stale results are served while a background refresh runs
+scrape_cache = ScrapeCache(
+    ttl=int(os.environ.get("SCRAPE_CACHE_TTL", 600)),
+    stale_ttl=int(os.environ.get("SCRAPE_CACHE_STALE_TTL", 3600)),
+    max_bytes=int(os.environ.get("SCRAPE_CACHE_MAX_MB", 64)) * 1024 * 1024,
+    disk_dir=os.environ.get("SCRAPE_CACHE_DIR", "scrape_cache") or None,
+    wait_timeout=int(os.environ.get("SCRAPE_CACHE_WAIT_TIMEOUT", 600))
+)
+
+# Product embeddings persisted across searches
+catalog = EmbeddingCatalog(
+    root=os.environ.get("CATALOG_DIR", "catalog"),
+    model_name=CLIP_MODEL_NAME,
+    preprocess_version=PREPROCESS_VERSION,
+    dtype=os.environ.get("CATALOG_DTYPE", "float32"),
+    backend=image_encoder.name
+)
+# Original-view embeddings of products the cascade did not fully embed
+view_catalog = EmbeddingCatalog(
+    root=os.environ.get("CATALOG_DIR", "catalog"),
+    model_name=CLIP_MODEL_NAME,
+    preprocess_version=PREPROCESS_VERSION + "-original",
+    dtype=os.environ.get("CATALOG_DTYPE", "float32"),
+    backend=image_encoder.name
+)
+# Load catalogs pre-built by the offline indexer (indexer.py) up front
+if os.environ.get("CATALOG_PRELOAD", "1") == "1":
+    print(f"📦 Preloaded {catalog.preload()} store catalogs")
 
 def get_embedding(image):
     image_input = preprocess(image).unsqueeze(0).to(device)
     with torch.no_grad():
-        embedding = model.encode_image(image_input)
+        embedding = query_encoder.encode_image(image_input)
     return embedding / embedding.norm(dim=-1, keepdim=True)
 
+def embed_missing_products(store_key, img_urls, progress_callback=None, on_batch=None, views=ALL_VIEWS,
+                           target=None):
+    """
+    Download product images concurrently, embed them in batches as they arrive
+    and add them to the catalog.
+
+    `on_batch(urls, embeddings)` is called after each embedded batch.
+    `views` and `target` select which views are embedded and which catalog
+    they are added to (the multi-scale catalog by default).
+
+    Returns:
+        Dictionary mapping image URL to its (len(views), D) embeddings
+    """
+    target = target or catalog
+    embedded = {}
+    missing_urls = list(dict.fromkeys(img_urls))
+    if not missing_urls:
+        return embedded
+
+    if progress_callback:
+        progress_callback({"message": f"Embedding {len(missing_urls)} product images..."})
+
+    embedding_stream = iter_multi_scale_embeddings(
+        image_downloader.iter_images(missing_urls),
+        catalog_encoder, preprocess, device, batch_size=EMBED_BATCH_SIZE, views=views
+    )
+    for batch_urls, batch_embeddings in embedding_stream:
+        batch_embeddings = batch_embeddings.float().cpu().numpy()
+        target.add(store_key, batch_urls, batch_embeddings)
+        embedded.update(zip(batch_urls, batch_embeddings))
+
+        if on_batch:
+            on_batch(batch_urls, batch_embeddings)
+        if progress_callback:
+            progress_callback({"message": f"Matching images... {len(embedded)}/{len(missing_urls)}"})
+
+    return embedded
+
+def recall_candidate_counts(top_x):
+    """Candidate counts (values of CASCADE_CANDIDATES) at which cascade recall is reported."""
+    return sorted({max(top_x, CASCADE_CANDIDATES // 4), max(top_x, CASCADE_CANDIDATES // 2),
+                   CASCADE_CANDIDATES, CASCADE_CANDIDATES * 2})
+
+def estimate_cascade_recall(ad_embeddings, full_embeddings, ranks, total, top_x):
+    """
+    Estimate the first stage's recall@top_x while the cascade is on.
+
+    Only the CASCADE_CANDIDATES best products of stage 1 and a uniform
+    sample of the others have all views. Each sampled product stands for
+    (total - CASCADE_CANDIDATES) / sample size products, so the weighted
+    products with the best multi-scale scores estimate the true top_x.
+
+    Args:
+        full_embeddings: Dictionary mapping image URL to (3, D) embeddings
+        ranks: Dictionary mapping image URL to its stage 1 rank
+        total: Number of products ranked in stage 1
+
+    Returns:
+        Dictionary mapping each candidate count (as a string) to estimated recall
+    """
+    urls = list(full_embeddings)
+    scores, _ = compute_advanced_similarity_batch(
+        ad_embeddings, torch.from_numpy(np.stack([full_embeddings[url] for url in urls]))
+    )
+    scores = scores.cpu().numpy()
+    url_ranks = np.array([ranks[url] for url in urls])
+    weights = np.ones(len(urls))
+    sampled = url_ranks >= CASCADE_CANDIDATES
+    if sampled.any():
+        weights[sampled] = (total - CASCADE_CANDIDATES) / sampled.sum()
+    # Best scores first, until their weights add up to top_x products
+    order = np.argsort(-scores)
+    top = order[:np.searchsorted(np.cumsum(weights[order]), top_x) + 1]
+    return {
+        str(m): round(float(weights[top][url_ranks[top] < m].sum() / weights[top].sum()), 4)
+        for m in recall_candidate_counts(top_x)
+    }
+
+def run_cascade(store_key, ad_embeddings, cached, missing, top_x, progress_callback=None, on_batch=None):
+    """
+    Two-stage scoring for stores whose products are not all embedded yet.
+
+    Stage 1 ranks every product by its original view only: cached products
+    reuse the first view of their catalog entry, the others are looked up in
+    (or embedded into) the original-view catalog. Stage 2 computes the
+    center-crop and contrast views of the best CASCADE_CANDIDATES products
+    that lack them and adds their full embeddings to the catalog. With
+    CASCADE_RECALL_SAMPLE, a random sample of products gets all views too
+    and is used to estimate the first stage's recall.
+
+    `on_batch(urls, embeddings)` is called with each batch of stage 1
+    (original-view) embeddings.
+
+    Returns:
+        Tuple (candidates, embedded, info): image URLs of the stage 1 top
+        candidates, the (3, D) embeddings computed in stage 2, and a
+        summary with counts and the recall estimate
+    """
+    originals, to_embed = view_catalog.lookup(store_key, missing)
+    try:
+        originals.update(embed_missing_products(
+            store_key, to_embed, progress_callback=progress_callback, on_batch=on_batch,
+            views=ORIGINAL_VIEW, target=view_catalog
+        ))
+    finally:
+        view_catalog.save(store_key)
+
+    first_stage = {url: view_embeddings[:1] for url, view_embeddings in cached.items()}
+    first_stage.update(originals)
+    urls = list(first_stage)
+    info = {"first_stage_products": len(urls), "original_view_hits": len(missing) - len(to_embed),
+            "original_view_misses": len(to_embed)}
+    if not urls:
+        return [], {}, {**info, "candidates": 0, "refined": 0}
+    _, order = compute_advanced_similarity_batch(
+        ad_embeddings, torch.from_numpy(np.stack([first_stage[url] for url in urls]))
+    )
+    ranked = [urls[i] for i in order.tolist()]
+    candidates = ranked[:CASCADE_CANDIDATES]
+
+    sample = []
+    if CASCADE_RECALL_SAMPLE:
+        rest = ranked[CASCADE_CANDIDATES:]
+        sample = [rest[i] for i in np.random.default_rng().permutation(len(rest))[:CASCADE_RECALL_SAMPLE]]
+    to_refine = [url for url in dict.fromkeys(candidates + sample) if url not in cached]
+    print(f"🪜 Cascade kept {len(candidates)} of {len(urls)} products, {len(to_refine)} need detail views")
+    if progress_callback:
+        progress_callback({"message": f"Refining the {len(candidates)} best candidates..."})
+
+    embedded = {}
+    try:
+        embedding_stream = iter_multi_scale_embeddings(
+            image_downloader.iter_images(to_refine),
+            catalog_encoder, preprocess, device, batch_size=EMBED_BATCH_SIZE, views=DETAIL_VIEWS
+        )
+        for batch_urls, detail_embeddings in embedding_stream:
+            # Original view from stage 1 + center crop and contrast = the catalog's (3, D) layout
+            full = np.concatenate([
+                np.stack([originals[url] for url in batch_urls]).astype(np.float32),
+                detail_embeddings.float().cpu().numpy()
+            ], axis=1)
+            catalog.add(store_key, batch_urls, full)
+            embedded.update(zip(batch_urls, full))
+    finally:
+        catalog.save(store_key)
+
+    info.update(candidates=len(candidates), refined=len(embedded))
+    if sample:
+        full_embeddings = {}
+        for url in candidates + sample:
+            view_embeddings = cached.get(url, embedded.get(url))
+            if view_embeddings is not None:
+                full_embeddings[url] = view_embeddings
+        ranks = {url: rank for rank, url in enumerate(ranked)}
+        recall = estimate_cascade_recall(ad_embeddings, full_embeddings, ranks, len(urls), top_x)
+        print(f"🪜 Cascade recall@{top_x} estimated with {len(sample)} sampled products: {recall}")
+        info.update(recall_at_k=recall, k=top_x, recall_sample=len(sample))
+    return candidates, embedded, info
+
 # ---------------------------
 # Flask App
 # ---------------------------
 app = Flask(__name__)
-progress_data = {"count": 0, "done": False, "message": ""}
-progress_lock = threading.Lock()
+# Job state files shared by all gunicorn workers, so any of them can serve a job's
+# progress, results and cancel requests (empty to keep jobs in process memory only)
+jobs = JobRegistry(root=os.environ.get("JOBS_DIR", "jobs") or None)
+# Largest number of results a search may ask for
+MAX_TOP_X = 100
+# Progress streams send at most one event per interval and a heartbeat when idle
+PROGRESS_MIN_INTERVAL_SECONDS = 0.1
+PROGRESS_HEARTBEAT_SECONDS = 15
+
+# Searches run in the background; SEARCH_QUEUE_SIZE more may wait before new ones are rejected
+worker_pool = JobWorkerPool(
+    max_workers=int(os.environ.get("SEARCH_WORKERS", 2)),
+    max_queue=int(os.environ.get("SEARCH_QUEUE_SIZE", 8))
+)
 
 @app.route("/")
 def index():
@@ -47,136 +359,326 @@ def index():
 
 @app.route("/progress_stream")
 def progress_stream():
+    job = jobs.get(request.args.get("job_id", ""))
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+
     def event_stream():
-        last_count = -1
+        version = 0
         while True:
-            time.sleep(0.5)
-            with progress_lock:
-                current_data = progress_data.copy()
+            # Sleep until the job publishes a change; send a heartbeat comment if it stays quiet
+            update = job.wait_for_update(version, timeout=PROGRESS_HEARTBEAT_SECONDS)
+            if update is None:
+                yield ": heartbeat\n\n"
+                continue
 
-            if current_data["count"] != last_count or current_data.get("message"):
-                last_count = current_data["count"]
-                yield f"data: {json.dumps(current_data)}\n\n"
+            version, current_data = update
+            yield f"data: {json.dumps(current_data)}\n\n"
 
             if current_data.get("done"):
                 break
+
+            # Let bursts of updates coalesce into the next event
+            time.sleep(PROGRESS_MIN_INTERVAL_SECONDS)
     return Response(event_stream(), mimetype="text/event-stream")
 
-@app.route("/search", methods=["POST"])
-def search():
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.snapshot())
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    job.cancel()
+    return jsonify(job.snapshot())
+
+@app.route("/catalog_stats")
+def catalog_stats():
+    return jsonify(catalog.stats())
+
+@app.route("/startup_stats")
+def startup_stats():
+    return jsonify({**startup_timings, "backend_name": image_encoder.name, "pid": os.getpid()})
+
+@app.route("/inference_stats")
+def inference_stats():
+    return jsonify(inference.stats())
+
+@app.route("/image_cache_stats")
+def image_cache_stats():
+    return jsonify(image_cache.stats())
+
+@app.route("/scrape_cache_stats")
+def scrape_cache_stats():
+    return jsonify(scrape_cache.stats())
+
+@app.route("/browser_pool_stats")
+def browser_pools():
+    return jsonify(browser_pool_stats())
+
+def submit_job(job, fn, *args):
+    """
+    Queue `fn(job, *args)` on the worker pool.
+
+    Returns:
+        202 response with the job's URLs, or 503 when the queue is full
+    """
     try:
-        if "image" not in request.files:
-            return jsonify({"error": "No image uploaded"}), 400
+        worker_pool.submit(job, fn, *args)
+    except QueueFull as e:
+        job.fail(e)
+        response = jsonify({"error": str(e), "job_id": job.id})
+        response.headers["Retry-After"] = "5"
+        return response, 503
 
-        ad_file = request.files["image"]
-        top_x = int(request.form.get("top_x", 5))
-        target_url = request.form.get("target_url", "bouldergear.com")
-        deduplicate = request.form.get("deduplicate") == "on"  # Checkbox value
+    return jsonify({
+        "job_id": job.id,
+        "status_url": f"/jobs/{job.id}",
+        "results_url": f"/results/{job.id}",
+        "progress_url": f"/progress_stream?job_id={job.id}"
+    }), 202
 
-        # Reset progress
-        with progress_lock:
-            progress_data["count"] = 0
-            progress_data["done"] = False
-            progress_data["message"] = "Starting scrape..."
+def run_refresh(job, store_url, collection):
+    """Refresh a Shopify catalog on a worker, reporting progress on the job."""
+    report = refresh_shopify_collection(
+        store_url, collection, catalog,
+        lambda store_key, img_urls: embed_missing_products(store_key, img_urls, progress_callback=job.update_progress),
+        progress_callback=job.update_progress
+    )
+    return {**report, "message": f"Refreshed: {report['embedded']} images embedded"}
 
-        # Open uploaded ad image and get multi-scale embeddings
-        try:
-            ad_img = Image.open(ad_file).convert("RGB")
-            print("🔍 Extracting multi-scale embeddings from query image...")
-            ad_embeddings = get_multi_scale_embeddings(ad_img, model, preprocess, device)
-        except Exception as e:
-            return jsonify({"error": f"Failed to process image: {str(e)}"}), 400
-
-        # Progress callback function
-        def update_progress(data):
-            with progress_lock:
-                progress_data.update(data)
-
-        print(f"Scraping products from {target_url} ...")
-
-        # Route to appropriate scraper
-        if "bouldergear.com" in target_url:
-            scraper_result = scrape_bouldergear_womens(progress_callback=update_progress)
-        elif ".myshopify.com" in target_url or any(domain in target_url for domain in ["allbirds", "gymshark", "fashionnova"]):
-            scraper_result = scrape_shopify_url(target_url, progress_callback=update_progress)
-        elif "tommy.com" in target_url:
-            scraper_result = scrape_us_tommy(target_url, progress_callback=update_progress)
-        else:
-            # Default to Boulder Gear for unknown URLs
-            scraper_result = scrape_bouldergear_womens(progress_callback=update_progress)
-
-        # Extract products and metadata from scraper result
-        products = scraper_result.get("products", [])
-        total_cards = scraper_result.get("total_cards", 0)
-        unique_products = scraper_result.get("unique_products", len(products))
-
-        if not products:
-            with progress_lock:
-                progress_data["done"] = True
-                progress_data["message"] = "No products found on the page"
-            return jsonify({"results": [], "total_products_searched": 0, "total_cards_loaded": 0, "matches_returned": 0})
-
-        # Update progress for matching phase
-        with progress_lock:
-            progress_data["message"] = "Matching products with your image..."
-            progress_data["done"] = False
-
-        results = []
-        total_products = len(products)
-        print(f"🎯 Using advanced matching algorithm with {len(products)} products...")
-
-        for idx, p in enumerate(products):
-            try:
-                resp = requests.get(p["img_url"], timeout=10)
-                img = Image.open(BytesIO(resp.content)).convert("RGB")
-
-                # Get multi-scale embeddings for product
-                product_embeddings = get_multi_scale_embeddings(img, model, preprocess, device)
-
-                # Compute advanced similarity score
-                score = compute_advanced_similarity(ad_embeddings, product_embeddings)
-
-                results.append({"product": p, "score": score})
-
-                # Update progress every 5 products during matching
-                if (idx + 1) % 5 == 0:
-                    with progress_lock:
-                        progress_data["message"] = f"Matching images... {idx + 1}/{total_products}"
-            except Exception as e:
-                print(f"⚠️ Error processing product {p.get('name', 'unknown')}: {e}")
-                continue
+@app.route("/refresh", methods=["POST"])
+def refresh():
+    """Queue an incremental refresh of a Shopify store/collection's catalog."""
+    store_url = request.form.get("store_url", "bouldergear.com")
+    collection = request.form.get("collection", "womens")
+
+    # Same admission control as searches: refreshes embed whole stores
+    return submit_job(jobs.create(), run_refresh, store_url, collection)
+
+def run_search(job, ad_img, target_url, top_x, deduplicate):
+    """
+    Scrape the target store and rank its products against the query image.
+
+    Runs on a worker; progress is reported on the job and JobCancelled is
+    raised if the job is cancelled.
+
+    Returns:
+        Dictionary with results, search metadata and a final status message
+    """
+    update_progress = job.update_progress
+
+    # Get multi-scale embeddings of the uploaded ad image
+    print("🔍 Extracting multi-scale embeddings from query image...")
+    ad_embeddings = get_multi_scale_embeddings_batch([ad_img], query_encoder, preprocess, device)[0]
+
+    update_progress({"count": 0, "message": "Starting scrape..."})
+
+    print(f"Scraping products from {target_url} ...")
+
+    # Identical concurrent scrapes run once; recent results come straight from the cache
+    scraper_result = scrape_cache.get_or_scrape(
+        catalog_key(target_url),
+        lambda callback: scrapers.scrape(target_url, progress_callback=callback),
+        progress_callback=update_progress,
+        cancel_check=job.raise_if_cancelled
+    )
+    job.raise_if_cancelled()
+
+    # Extract products and metadata from scraper result
+    products = scraper_result.get("products", [])
+    total_cards = scraper_result.get("total_cards", 0)
+
+    if not products:
+        return {"results": [], "total_products_searched": 0, "total_cards_loaded": 0, "matches_returned": 0,
+                "scroll_stats": scraper_result.get("scroll_stats"), "message": "No products found on the page"}
 
-        # Sort by score
-        results.sort(key=lambda x: x["score"], reverse=True)
+    # Update progress for matching phase
+    update_progress({"message": "Matching products with your image..."})
 
-        # Apply diversity re-ranking if requested
-        if deduplicate:
-            print(f"🔄 Re-ranking top results for diversity...")
-            results_top = rerank_with_diversity(results, top_k=top_x, diversity_weight=0.2)
+    results = []
+    total_products = len(products)
+    print(f"🎯 Using advanced matching algorithm with {len(products)} products...")
+
+    # Reuse catalog embeddings; only new or changed products get embedded. Products
+    # missing from the listing are only dropped when the scraper reports it complete
+    store_key = catalog_key(scraper_result.get("source", target_url))
+    sync_report = catalog.sync_products(store_key, products, complete=scraper_result.get("complete", False))
+    # Cascade searches count original-view catalog hits too, so the counters are updated below
+    cached, missing = catalog.lookup(store_key, [p["img_url"] for p in products], count=not CASCADE_CANDIDATES)
+    print(f"📦 Catalog: {len(cached)} cached, {len(missing)} to embed")
+    if CASCADE_CANDIDATES:
+        view_catalog.sync_products(store_key, products, complete=scraper_result.get("complete", False))
+
+    # Stream the best matches found so far while product images are still being embedded
+    product_by_url = {}
+    for p in products:
+        product_by_url.setdefault(p["img_url"], p)
+    partial_scores = {}
+
+    def publish_partial_results(urls, embeddings):
+        if not urls:
+            return
+        scores, _ = compute_advanced_similarity_batch(ad_embeddings, torch.from_numpy(np.stack(embeddings)))
+        partial_scores.update(zip(urls, scores.tolist()))
+        best = heapq.nlargest(top_x, partial_scores.items(), key=lambda item: item[1])
+        update_progress({"partial_results": [{"product": product_by_url[url], "score": score} for url, score in best]})
+
+    query_vector = ad_embeddings.float().mean(dim=0).cpu().numpy()
+
+    def index_candidates():
+        # Large catalogs: the vector index picks the candidates, so only their rows are read
+        index = catalog.vector_index(store_key, kind=ANN_INDEX_KIND)
+        catalog.save(store_key)
+        return {url for url, _ in index.search(query_vector, k=ANN_CANDIDATES)}
+
+    cascade = None
+    candidates = None
+    if CASCADE_CANDIDATES and missing and len(product_by_url) > CASCADE_CANDIDATES:
+        # Partial results use the same single-view scores as the first stage
+        publish_partial_results(list(cached), [view_embeddings[:1] for view_embeddings in cached.values()])
+        candidates, embedded, cascade = run_cascade(
+            store_key, ad_embeddings, cached, missing, top_x,
+            progress_callback=update_progress, on_batch=publish_partial_results
+        )
+        candidates = set(candidates)
+        # Products whose original view was already cataloged needed no embedding for this search
+        catalog_hits = len(cached) + cascade["original_view_hits"]
+        catalog_misses = cascade["original_view_misses"]
+    else:
+        if len(cached) > ANN_MIN_PRODUCTS:
+            early_candidates = [url for url in index_candidates() if url in cached]
+            publish_partial_results(early_candidates, [cached[url] for url in early_candidates])
         else:
-            print(f"📋 Returning top {top_x} results without deduplication...")
-            results_top = results[:top_x]
-
-        # Mark as done
-        with progress_lock:
-            progress_data["done"] = True
-            progress_data["message"] = f"Complete! Found top {len(results_top)} matches"
-
-        # Return results with metadata
-        return jsonify({
-            "results": results_top,
-            "total_products_searched": total_products,
-            "total_cards_loaded": total_cards,
-            "matches_returned": len(results_top)
-        })
+            publish_partial_results(list(cached), list(cached.values()))
+
+        try:
+            embedded = embed_missing_products(
+                store_key, missing, progress_callback=update_progress, on_batch=publish_partial_results
+            )
+        finally:
+            # Also on cancellation: the next search of this store reuses the rows embedded so far
+            catalog.save(store_key)
+        catalog_hits, catalog_misses = len(cached), len(missing)
+    if CASCADE_CANDIDATES:
+        catalog.record_lookups(catalog_hits, catalog_misses)
+
+    narrowed = False
+    if candidates is None and len(cached) + len(embedded) > ANN_MIN_PRODUCTS:
+        candidates = index_candidates()
+        narrowed = True
+        print(f"🧭 Vector index narrowed {len(cached) + len(embedded)} products to {len(candidates)} candidates")
+
+    # Stack embeddings of every (candidate) product that has them into one (N, 3, D) matrix
+    scored_products = []
+    product_matrix = []
+    for p in products:
+        if candidates is not None and p["img_url"] not in candidates:
+            continue
+        view_embeddings = cached.get(p["img_url"])
+        if view_embeddings is None:
+            view_embeddings = embedded.get(p["img_url"])
+        if view_embeddings is None:
+            continue
+        scored_products.append(p)
+        product_matrix.append(view_embeddings)
+
+    # Fully embedded store with the cascade enabled: measure how well the first stage
+    # would have kept the true top results, to help pick CASCADE_CANDIDATES
+    if CASCADE_CANDIDATES and cascade is None and not narrowed and len(scored_products) > top_x:
+        recall = cascade_recall(
+            ad_embeddings, torch.from_numpy(np.stack(product_matrix)), top_x, recall_candidate_counts(top_x)
+        )
+        print(f"🪜 Cascade recall@{top_x} by candidate count: {recall}")
+        cascade = {"candidates": CASCADE_CANDIDATES, "recall_at_k": recall, "k": top_x}
+
+    result_embeddings = None
+    if scored_products:
+        # Score all products at once; re-ranking needs the full ordering, otherwise only the top X
+        product_matrix = np.stack(product_matrix)
+        scores, order = compute_advanced_similarity_batch(
+            ad_embeddings,
+            torch.from_numpy(product_matrix),
+            top_k=None if deduplicate else top_x
+        )
+        results = [{"product": scored_products[i], "score": float(scores[i])} for i in order.tolist()]
+        result_embeddings = product_matrix[order.cpu().numpy()]
+
+    # Apply diversity re-ranking if requested
+    if deduplicate:
+        print(f"🔄 Re-ranking top results for diversity ({RERANK_METHOD})...")
+        results_top = rerank_with_diversity(
+            results, top_k=top_x, diversity_weight=0.2, method=RERANK_METHOD,
+            embeddings=result_embeddings, name_weight=RERANK_NAME_WEIGHT
+        )
+    else:
+        print(f"📋 Returning top {top_x} results without deduplication...")
+        results_top = results[:top_x]
 
+    return {
+        "results": results_top,
+        "total_products_searched": total_products,
+        "total_cards_loaded": total_cards,
+        "matches_returned": len(results_top),
+        "scraper": scraper_result.get("scraper"),
+        "scrape_cache": scraper_result.get("cache"),
+        # Browser scrapes only: cards loaded, scrolls, time to all cards and whether the listing was complete
+        "scroll_stats": scraper_result.get("scroll_stats"),
+        "catalog": {"hits": catalog_hits, "misses": catalog_misses, **sync_report},
+        "cascade": cascade,
+        "message": f"Complete! Found top {len(results_top)} matches"
+    }
+
+@app.route("/search", methods=["POST"])
+def search():
+    """Queue a search job and return its id immediately."""
+    if "image" not in request.files:
+        return jsonify({"error": "No image uploaded"}), 400
+
+    ad_file = request.files["image"]
+    try:
+        top_x = int(request.form.get("top_x", 5))
+    except ValueError:
+        return jsonify({"error": "top_x must be a whole number"}), 400
+    if not 1 <= top_x <= MAX_TOP_X:
+        return jsonify({"error": f"top_x must be between 1 and {MAX_TOP_X}"}), 400
+    target_url = request.form.get("target_url", "bouldergear.com")
+    deduplicate = request.form.get("deduplicate") == "on"  # Checkbox value
+
+    # Decode the upload now so a bad image is rejected before queueing
+    try:
+        ad_img = Image.open(ad_file).convert("RGB")
     except Exception as e:
-        print(f"❌ Error in search endpoint: {e}")
-        with progress_lock:
-            progress_data["done"] = True
-            progress_data["message"] = f"Error: {str(e)}"
-        return jsonify({"error": str(e)}), 500
+        return jsonify({"error": f"Failed to process image: {str(e)}"}), 400
+
+    return submit_job(jobs.create(), run_search, ad_img, target_url, top_x, deduplicate)
+
+@app.route("/results/<job_id>")
+def search_results(job_id):
+    """Return a finished job's results, or 202 with its progress while it runs."""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+
+    snapshot = job.snapshot()
+    if snapshot["status"] == "done":
+        return jsonify({**snapshot["result"], "job_id": job.id})
+    if snapshot["status"] == "failed":
+        return jsonify({"error": snapshot["error"], "job_id": job.id}), 500
+    if snapshot["status"] == "cancelled":
+        return jsonify({"error": "Search cancelled", "job_id": job.id}), 409
+    return jsonify(snapshot), 202
+
+@app.route("/queue_stats")
+def queue_stats():
+    return jsonify(worker_pool.stats())
 
 
 if __name__ == "__main__":
+    warmup()
     app.run(debug=True)
@@ -0,0 +1,40 @@
+"""
+Atomic file writes for state shared between processes.
+
+Files are written under a temporary name and renamed into place, so readers
+see either the previous or the new version, never a partial one. The
+temporary name is unique per process and thread: gunicorn workers, the
+offline indexer and background threads write the same files concurrently.
+"""
+import contextlib
+import os
+import threading
+
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """
+    Yield a temporary path to write; it replaces `path` when the block succeeds.
+
+    The temporary file is removed if the block raises.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+@contextlib.contextmanager
+def atomic_open(path, mode="w", encoding=None):
+    """Open a temporary file for writing that replaces `path` once closed."""
+    if encoding is None and "b" not in mode:
+        encoding = "utf-8"
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, mode, encoding=encoding) as f:
+            yield f
@@ -0,0 +1,267 @@
+"""
+Pool of warm Playwright browsers shared by scrape jobs.
+
+Playwright's sync API is bound to the thread that started it, so each pooled
+browser lives on its own worker thread. Jobs are handed to whichever worker
+is free and run against a fresh context/page on that worker's already
+running browser, instead of launching Chromium for every search. Browsers
+are recycled after `max_uses` leases or when they crash.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from playwright.sync_api import sync_playwright
+
+
+# Launch Chromium headed by default: many sites block headless browsers
+DEFAULT_LAUNCH_OPTIONS = {
+    "headless": False,
+    "args": [
+        '--disable-blink-features=AutomationControlled',
+        '--disable-dev-shm-usage',
+        '--no-sandbox'
+    ]
+}
+
+# Longest run() waits for a job by default, including time queued behind other jobs
+# (page load timeout + scroll time limit + extraction, with headroom)
+DEFAULT_RUN_TIMEOUT = 900
+# How often a waiting run() checks that the pool still has live workers
+WORKER_CHECK_INTERVAL = 1.0
+
+# Realistic browser settings to avoid bot detection
+DEFAULT_CONTEXT_OPTIONS = {
+    "ignore_https_errors": True,
+    "user_agent": 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    "viewport": {'width': 1920, 'height': 1080},
+    "locale": 'en-US',
+    "timezone_id": 'America/New_York',
+    "java_script_enabled": True
+}
+
+# Stealth script hiding the webdriver flag
+STEALTH_INIT_SCRIPT = """
+    Object.defineProperty(navigator, 'webdriver', {
+        get: () => undefined
+    });
+"""
+
+
+class BrowserPool:
+    """
+    Fixed number of warm browsers, each owned by a worker thread.
+
+    Args:
+        size: Maximum number of concurrent browsers (and scrapes)
+        max_uses: Recycle a browser after this many leases
+        launch_options: Options for chromium.launch
+        context_options: Options for browser.new_context
+        init_script: Script added to every new context
+    """
+
+    def __init__(self, size=2, max_uses=50, launch_options=None, context_options=None,
+                 init_script=STEALTH_INIT_SCRIPT):
+        self.size = size
+        self.max_uses = max_uses
+        self.launch_options = launch_options or DEFAULT_LAUNCH_OPTIONS
+        self.context_options = context_options or DEFAULT_CONTEXT_OPTIONS
+        self.init_script = init_script
+        self._tasks = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._leases = 0
+        self._launches = 0
+        self._recycles = 0
+        self._crashes = 0
+        self._startup_failures = 0
+        self._worker_count = 0
+        # Workers still starting Playwright, and workers running it
+        self._starting = 0
+        self._ready = 0
+        self._closed = False
+
+    def _ensure_workers(self):
+        # Workers start lazily so importing this module never launches a browser,
+        # and are replaced here if they died (e.g. Playwright failed to start)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Browser pool is closed")
+            self._workers = [worker for worker in self._workers if worker.is_alive()]
+            while len(self._workers) < self.size:
+                worker = threading.Thread(
+                    target=self._worker_loop,
+                    name=f"browser-pool-{self._worker_count}",
+                    daemon=True
+                )
+                self._worker_count += 1
+                self._starting += 1
+                self._workers.append(worker)
+                worker.start()
+
+    def run(self, fn, context_options=None, timeout=DEFAULT_RUN_TIMEOUT):
+        """
+        Run `fn(page)` on a pooled browser and return its result.
+
+        The page belongs to a fresh browser context that is closed afterwards,
+        so cookies and storage never leak between jobs. Blocks until a
+        browser is free when all are busy.
+
+        Args:
+            fn: Callable receiving a Playwright page
+            context_options: Overrides merged into the pool's context options
+            timeout: Maximum seconds to wait for the result (None waits indefinitely)
+
+        Raises:
+            TimeoutError: If no result arrives within `timeout`
+        """
+        self._ensure_workers()
+        future = Future()
+        self._tasks.put((fn, context_options or {}, future))
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            wait = WORKER_CHECK_INTERVAL if deadline is None else min(WORKER_CHECK_INTERVAL, deadline - time.time())
+            try:
+                return future.result(timeout=max(0.0, wait))
+            except FutureTimeout:
+                if deadline is not None and time.time() >= deadline:
+                    # Skipped by the worker if it has not started yet
+                    future.cancel()
+                    raise TimeoutError(f"Browser pool job did not finish within {timeout}s")
+                # Replace workers that died while the job was queued
+                self._ensure_workers()
+
+    def _launch(self, playwright):
+        browser = playwright.chromium.launch(**self.launch_options)
+        with self._lock:
+            self._launches += 1
+        return browser
+
+    def _fail_queued(self, error):
+        """Fail every queued job, when Playwright could not start on any worker."""
+        stop_signals = 0
+        while True:
+            try:
+                task = self._tasks.get_nowait()
+            except queue.Empty:
+                break
+            if task is None:
+                stop_signals += 1
+                continue
+            future = task[2]
+            if future.set_running_or_notify_cancel():
+                future.set_exception(error)
+        # Leave close()'s stop signals for the other workers
+        for _ in range(stop_signals):
+            self._tasks.put(None)
+
+    def _worker_loop(self):
+        try:
+            playwright = sync_playwright().start()
+        except Exception as e:
+            # Missing driver, no display, ...: once no worker is running or still starting,
+            # fail waiting jobs instead of leaving them queued forever; otherwise the other
+            # workers serve them. The next run() starts a replacement worker
+            print(f"❌ Could not start Playwright for the browser pool: {e}")
+            with self._lock:
+                self._startup_failures += 1
+                self._starting -= 1
+                no_live_workers = self._starting == 0 and self._ready == 0
+            if no_live_workers:
+                self._fail_queued(e)
+            return
+
+        with self._lock:
+            self._starting -= 1
+            self._ready += 1
+        try:
+            browser = None
+            uses = 0
+            while True:
+                task = self._tasks.get()
+                if task is None:
+                    break
+                fn, context_options, future = task
+                if not future.set_running_or_notify_cancel():
+                    continue
+
+                with self._lock:
+                    self._busy += 1
+                    self._leases += 1
+                try:
+                    if browser is None or not browser.is_connected():
+                        browser = self._launch(playwright)
+                        uses = 0
+                    uses += 1
+
+                    context = browser.new_context(**{**self.context_options, **context_options})
+                    try:
+                        if self.init_script:
+                            context.add_init_script(self.init_script)
+                        future.set_result(fn(context.new_page()))
+                    finally:
+                        context.close()
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                    if browser is not None and not browser.is_connected():
+                        print(f"⚠️ Pooled browser crashed: {e}")
+                        with self._lock:
+                            self._crashes += 1
+                        browser = None
+                finally:
+                    with self._lock:
+                        self._busy -= 1
+
+                if browser is not None and uses >= self.max_uses:
+                    print(f"♻️ Recycling pooled browser after {uses} uses")
+                    self._close_browser(browser)
+                    browser = None
+                    with self._lock:
+                        self._recycles += 1
+
+            if browser is not None:
+                self._close_browser(browser)
+        finally:
+            with self._lock:
+                self._ready -= 1
+            try:
+                playwright.stop()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _close_browser(browser):
+        try:
+            browser.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        """Return pool size, utilization and lifecycle counters."""
+        with self._lock:
+            return {
+                "size": self.size,
+                "workers": len(self._workers),
+                "busy": self._busy,
+                "utilization": round(self._busy / self.size, 2) if self.size else 0.0,
+                "queued": self._tasks.qsize(),
+                "leases": self._leases,
+                "launches": self._launches,
+                "recycles": self._recycles,
+                "crashes": self._crashes,
+                "startup_failures": self._startup_failures,
+            }
+
+    def close(self, timeout=10):
+        """Stop all workers and close their browsers."""
+        with self._lock:
+            self._closed = True
+            workers = list(self._workers)
+        for _ in workers:
+            self._tasks.put(None)
+        deadline = time.time() + timeout
+        for worker in workers:
+            worker.join(max(0.0, deadline - time.time()))
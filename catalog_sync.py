@@ -0,0 +1,85 @@
+"""
+Incremental catalog refresh for Shopify collections.
+
+The product listing is re-pulled from the JSON API (cheap), but images are
+only re-downloaded and re-embedded for products that are new or whose
+`updated_at` or image changed since the last refresh. Deleted products are
+dropped from the catalog.
+
+Products are synced and embedded a chunk at a time while later pages are
+still being fetched, so embedding starts with the first page instead of
+waiting for the whole listing.
+"""
+import time
+
+import requests
+
+from embedding_catalog import catalog_key
+from scraper_shopify import SHOPIFY_PAGE_LIMIT, iter_shopify_products, shopify_source
+
+# Products synced and embedded together; one full products.json page
+REFRESH_CHUNK_SIZE = SHOPIFY_PAGE_LIMIT
+
+
+def refresh_shopify_collection(store_url, collection, catalog, embed_missing, progress_callback=None,
+                               chunk_size=REFRESH_CHUNK_SIZE):
+    """
+    Bring the catalog for a Shopify collection up to date.
+
+    Args:
+        store_url: Store domain (e.g., "bouldergear.com")
+        collection: Collection handle, or "all" for all products
+        catalog: EmbeddingCatalog to update
+        embed_missing: Callable (store_key, img_urls) -> {img_url: embeddings}
+                       that embeds images and adds them to the catalog
+        progress_callback: Optional callback for progress updates
+        chunk_size: Number of products synced and embedded at a time
+
+    Returns:
+        Dictionary with added, updated, removed and unchanged product counts,
+        the number of products listed and images embedded, and the elapsed time
+    """
+    start = time.time()
+    store_key = catalog_key(shopify_source(store_url, collection))
+    report = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "embedded": 0}
+    products = []
+    complete = True
+
+    def sync_and_embed(chunk):
+        chunk_report = catalog.sync_products(store_key, chunk, complete=False)
+        for name in ("added", "updated", "unchanged"):
+            report[name] += chunk_report[name]
+        # Hit/miss counters describe searches; refreshes stay out of them
+        _, missing = catalog.lookup(store_key, [p["img_url"] for p in chunk], count=False)
+        report["embedded"] += len(embed_missing(store_key, missing))
+
+    if progress_callback:
+        progress_callback({"message": f"Fetching products from {store_url}..."})
+
+    try:
+        chunk = []
+        try:
+            for product in iter_shopify_products(store_url, collection):
+                products.append(product)
+                chunk.append(product)
+                if len(chunk) >= chunk_size:
+                    sync_and_embed(chunk)
+                    chunk = []
+        except requests.exceptions.RequestException as e:
+            # Keep what was listed; without the full listing nothing can be pruned
+            print(f"⚠️ Listing of {store_key} stopped after {len(products)} products: {e}")
+            complete = False
+        if chunk:
+            sync_and_embed(chunk)
+
+        # Prune only against a full listing; an empty one means the API failed, not an empty store
+        if complete and products:
+            report["removed"] = catalog.prune_products(store_key, products)
+    finally:
+        # Publish the chunks embedded before a cancellation or error, so the next refresh skips them
+        catalog.save(store_key)
+
+    report["products"] = len(products)
+    report["seconds"] = round(time.time() - start, 2)
+    print(f"✅ Refreshed {store_key}: embedded {report['embedded']} images in {report['seconds']}s")
+    return report
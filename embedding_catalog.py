@@ -0,0 +1,585 @@
+"""
+Persistent on-disk catalog of product image embeddings.
+
+Embeddings are grouped by store/collection and keyed by image URL, so repeat
+searches against the same store only need to embed the query image.
+"""
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from urllib.parse import urlparse
+
+import numpy as np
+
+from atomic_file import atomic_open, atomic_path
+from vector_index import FlatIndex, make_index
+
+
+def _parse_timestamp(value):
+    """Parse an ISO 8601 `updated_at` (e.g. "2024-05-01T10:00:00-04:00"), or None."""
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def catalog_key(url):
+    """
+    Normalize a store/collection URL into a catalog key.
+
+    Examples:
+        - "https://BoulderGear.com/collections/womens/" → "bouldergear.com/collections/womens"
+        - "usa.tommy.com/en/women" → "usa.tommy.com/en/women"
+    """
+    url = url.strip()
+    if "://" not in url:
+        url = "https://" + url
+    parsed = urlparse(url)
+    path = parsed.path.rstrip("/")
+    return f"{parsed.netloc.lower()}{path}"
+
+
+class EmbeddingCatalog:
+    """
+    Multi-scale product embeddings stored per store/collection on disk.
+
+    Each store key maps to a contiguous `.npy` matrix of shape (N, V, D)
+    (V = 3 views for multi-scale catalogs, 1 for original-view ones) plus a
+    `.json` sidecar holding the image URL of every row, a manifest of the
+    last scraped image URL and `updated_at` of every product, and the name
+    of the current matrix file. The model name, inference backend and
+    preprocessing version are part of the file name, so embeddings from a
+    different model, backend or view pipeline are never mixed with the
+    current ones.
+
+    Matrices are opened with `numpy.memmap`, so processes serving the same
+    catalog share the vectors through the page cache instead of each holding
+    a copy. New embeddings are kept in memory until `save` publishes a new
+    version: a new matrix file is written first, then the sidecar is
+    atomically replaced to point at it. Readers pick up published versions
+    on their next access. Saves of the same store from several processes are
+    serialized with a lock file, and each merges its changes into whatever
+    version was published last.
+
+    Each store has its own lock, so a slow save of one store never blocks
+    lookups in another, and the matrix is written without holding it.
+    """
+
+    def __init__(self, root="catalog", model_name="ViT-B/32", preprocess_version="v1", dtype="float32",
+                 backend="fp32"):
+        self.root = root
+        self.model_name = model_name
+        self.backend = backend
+        self.preprocess_version = preprocess_version
+        # float16 halves disk and page cache use at a small precision cost
+        self.dtype = np.dtype(dtype)
+        self.hits = 0
+        self.misses = 0
+        self._stores = {}
+        # Guards `_stores` and the counters; each store entry has its own lock
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _base_path(self, store_key):
+        identity = f"{self.model_name}|{self.preprocess_version}|{store_key}"
+        if self.backend != "fp32":
+            # fp32 keeps the original key so existing catalogs stay valid
+            identity = f"{self.model_name}|{self.backend}|{self.preprocess_version}|{store_key}"
+        digest = hashlib.sha1(identity.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.root, digest)
+
+    @contextlib.contextmanager
+    def _locked(self, store_key):
+        """Yield the loaded entry for a store while holding its lock."""
+        with self._lock:
+            store = self._stores.get(store_key)
+            if store is None:
+                store = self._stores[store_key] = {
+                    "matrix": None, "vectors_file": None, "rows": {}, "pending": {}, "products": {},
+                    "index": None, "dirty": False, "index_dirty": False, "version": 0, "mtime": None,
+                    "removed": set(), "product_changes": {}, "saving": {}, "loaded": False,
+                    "lock": threading.RLock(),
+                }
+        with store["lock"]:
+            yield self._load(store_key, store)
+
+    def _load(self, store_key, store):
+        """
+        Read a store from disk on first use and switch it to a newer published
+        version when there is one; the caller holds the store lock.
+        """
+        if not store["loaded"]:
+            self._read_published(store_key, store)
+            store["loaded"] = True
+        elif not store["dirty"]:
+            try:
+                mtime = os.stat(self._base_path(store_key) + ".json").st_mtime_ns
+            except OSError:
+                mtime = store["mtime"]
+            if mtime != store["mtime"]:
+                self._read_published(store_key, store)
+                print(f"🔄 Switched {store_key} to catalog version {store['version']}")
+        return store
+
+    def _read_published(self, store_key, store):
+        """Map the published version of a store into `store`; the caller holds the store lock."""
+        base = self._base_path(store_key)
+        # Retry once: a concurrent save may delete the old matrix right after we read the sidecar
+        for _ in range(2):
+            try:
+                mtime = os.stat(base + ".json").st_mtime_ns
+                with open(base + ".json", "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                vectors_file = meta.get("vectors_file", os.path.basename(base) + ".npy")
+                matrix = np.load(os.path.join(self.root, vectors_file), mmap_mode="r")
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                print(f"⚠️ Ignoring unreadable catalog for {store_key}: {e}")
+                return
+            store.update(
+                matrix=matrix,
+                vectors_file=vectors_file,
+                rows={url: i for i, url in enumerate(meta["urls"])},
+                pending={},
+                products=meta.get("products", {}),
+                version=meta.get("version", 0),
+                mtime=mtime,
+                dirty=False,
+                removed=set(),
+                product_changes={},
+            )
+            return
+
+    @staticmethod
+    def _read_sidecar(base):
+        """Return the published sidecar of a store, or None if there is none."""
+        try:
+            with open(base + ".json", "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _vector(store, url):
+        """(V, D) embeddings of an image URL, or None; the caller holds the store lock."""
+        if url in store["pending"]:
+            return store["pending"][url]
+        if url in store["saving"]:
+            # Being written by a save that has not re-mapped the store yet
+            return store["saving"][url]
+        row = store["rows"].get(url)
+        return None if row is None else store["matrix"][row]
+
+    @staticmethod
+    def _urls(store):
+        urls = dict.fromkeys(store["rows"])
+        urls.update(dict.fromkeys(store["saving"]))
+        urls.update(dict.fromkeys(store["pending"]))
+        return list(urls)
+
+    @staticmethod
+    def _discard(store, url):
+        store["rows"].pop(url, None)
+        store["pending"].pop(url, None)
+        store["saving"].pop(url, None)
+        # Remembered so a merge with another process's newer version drops it too
+        store["removed"].add(url)
+
+    def lookup(self, store_key, img_urls, count=True):
+        """
+        Look up cached embeddings for a list of image URLs.
+
+        With `count=False` the hit/miss counters are left alone, for callers
+        that find some misses elsewhere and report them with `record_lookups`.
+
+        Returns:
+            Tuple (found, missing) where found maps image URL to a (V, D)
+            array (a read-only view of the mapped matrix, in the catalog
+            dtype) and missing lists the URLs with no cached entry.
+        """
+        found = {}
+        missing = []
+        with self._locked(store_key) as store:
+            for url in img_urls:
+                vector = self._vector(store, url)
+                if vector is not None:
+                    found[url] = vector
+                else:
+                    missing.append(url)
+        if count:
+            self.record_lookups(len(found), len(missing))
+        return found, missing
+
+    def record_lookups(self, hits, misses):
+        """Add to the hit/miss counters reported by `stats`."""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def add(self, store_key, img_urls, embeddings):
+        """Store (N, V, D) embeddings for the given image URLs."""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        with self._locked(store_key) as store:
+            for url, emb in zip(img_urls, embeddings):
+                store["pending"][url] = emb
+            store["dirty"] = True
+
+    def sync_products(self, store_key, products, complete=True):
+        """
+        Reconcile the catalog with a fresh scrape of a store.
+
+        Products are matched by Shopify id (or link when there is none).
+        A product counts as updated when its `updated_at` is newer than the
+        cataloged one, or its image URL changed and there is no timestamp to
+        compare; its embedding is only dropped (to be re-embedded) when the
+        image URL changed. Listings older than the catalog (e.g. a stale
+        cached scrape) leave it untouched. When the scrape covers the whole
+        store (`complete`), products that disappeared are dropped too.
+
+        Returns:
+            Dictionary with added, updated, removed and unchanged counts
+        """
+        report = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+        with self._locked(store_key) as store:
+            manifest = store["products"]
+            seen = set()
+
+            for p in products:
+                img_url = p.get("img_url")
+                key = self._product_key(p)
+                if not img_url or key in seen:
+                    continue
+                seen.add(key)
+
+                entry = {"img_url": img_url, "updated_at": p.get("updated_at")}
+                previous = manifest.get(key)
+                if previous is None:
+                    report["added"] += 1
+                elif previous == entry or not self._is_update(previous, entry):
+                    report["unchanged"] += 1
+                    continue
+                else:
+                    report["updated"] += 1
+                    if previous["img_url"] != img_url:
+                        self._discard(store, previous["img_url"])
+                        self._discard(store, img_url)
+                manifest[key] = entry
+                store["product_changes"][key] = entry
+                store["dirty"] = True
+
+            if complete:
+                report["removed"] = self._prune(store, seen)
+
+        print(
+            f"🔁 Catalog sync for {store_key}: {report['added']} added, {report['updated']} updated, "
+            f"{report['removed']} removed, {report['unchanged']} unchanged"
+        )
+        return report
+
+    @staticmethod
+    def _is_update(previous, entry):
+        """Whether a listed entry supersedes the cataloged one."""
+        previous_time = _parse_timestamp(previous.get("updated_at"))
+        current_time = _parse_timestamp(entry["updated_at"])
+        if previous_time is not None and current_time is not None:
+            try:
+                return current_time > previous_time
+            except TypeError:
+                # Naive vs. timezone-aware timestamps
+                pass
+        return previous["img_url"] != entry["img_url"]
+
+    def prune_products(self, store_key, products):
+        """
+        Drop the products (and their embeddings) missing from `products`, a
+        complete listing of the store that was synced in parts with
+        `sync_products(..., complete=False)`.
+
+        Returns:
+            Number of products removed
+        """
+        with self._locked(store_key) as store:
+            removed = self._prune(store, {self._product_key(p) for p in products if p.get("img_url")})
+        if removed:
+            print(f"🔁 Catalog sync for {store_key}: {removed} removed")
+        return removed
+
+    @staticmethod
+    def _product_key(product):
+        return str(product.get("id") or product.get("link") or product.get("img_url"))
+
+    def _prune(self, store, keep):
+        """Remove manifest entries whose key is not in `keep`; the caller holds the store lock."""
+        manifest = store["products"]
+        stale = [key for key in manifest if key not in keep]
+        for key in stale:
+            self._discard(store, manifest.pop(key)["img_url"])
+            store["product_changes"][key] = None
+            store["dirty"] = True
+        return len(stale)
+
+    def vector_index(self, store_key, kind="ivf"):
+        """
+        Return the first-stage vector index for a store, in sync with its embeddings.
+
+        The index holds the mean of each product's view embeddings keyed by
+        image URL, and is persisted next to the catalog on `save`.
+        """
+        with self._locked(store_key) as store:
+            urls = self._urls(store)
+            index = store["index"]
+            index_path = self._base_path(store_key) + ".index.npz"
+
+            if index is None and os.path.exists(index_path):
+                try:
+                    index = FlatIndex.load(index_path)
+                    if index.kind != kind:
+                        index = None
+                except Exception as e:
+                    print(f"⚠️ Rebuilding unreadable vector index for {store_key}: {e}")
+                    index = None
+
+            if index is None:
+                dim = self._vector(store, urls[0]).shape[-1] if urls else 0
+                index = make_index(kind, dim)
+
+            url_set = set(urls)
+            stale = [url for url in index.ids if url not in url_set]
+            new_urls = [url for url in urls if url not in index]
+            if stale:
+                index.remove(stale)
+            if new_urls:
+                index.add(new_urls, np.stack([
+                    np.asarray(self._vector(store, url), dtype=np.float32).mean(axis=0) for url in new_urls
+                ]))
+
+            store["index"] = index
+            store["index_dirty"] = store["index_dirty"] or bool(stale or new_urls)
+            return index
+
+    def save(self, store_key, chunk_size=1024):
+        """
+        Publish a store's embeddings to disk as a new version if they changed.
+
+        The matrix is streamed into a new file in chunks, then the sidecar is
+        atomically replaced to point at it and the store is re-mapped from
+        disk, so unsaved embeddings never stay in process memory for long.
+        If another process published a newer version in the meantime, this
+        process's added and removed rows are applied on top of it.
+
+        Only the snapshot of the changes is taken under the store lock; the
+        file lock wait and the matrix write happen outside it, and changes
+        made during the write stay pending for the next save.
+        """
+        with self._lock:
+            store = self._stores.get(store_key)
+        if store is None:
+            return
+        base = self._base_path(store_key)
+
+        with store["lock"]:
+            index = store["index"] if store["index_dirty"] else None
+            store["index_dirty"] = False
+            snapshot = None
+            if store["dirty"]:
+                snapshot = {
+                    "matrix": store["matrix"],
+                    "vectors_file": store["vectors_file"],
+                    "rows": dict(store["rows"]),
+                    "products": dict(store["products"]),
+                    "version": store["version"],
+                    "pending": store["pending"],
+                    "removed": store["removed"],
+                    "product_changes": store["product_changes"],
+                }
+                # Pending rows stay readable from `saving` until the store is re-mapped
+                store["saving"].update(store["pending"])
+                store.update(pending={}, removed=set(), product_changes={}, dirty=False)
+
+        if index is not None:
+            index.save(base + ".index.npz")
+        if snapshot is None:
+            return
+
+        try:
+            # Serialize publishing across processes (app workers, the offline indexer)
+            with open(base + ".lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._publish(store_key, snapshot, base, chunk_size)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        except Exception:
+            with store["lock"]:
+                # Put the snapshot back in front of anything changed since
+                store["pending"] = {**snapshot["pending"], **store["pending"]}
+                store["removed"] |= snapshot["removed"] - set(store["pending"])
+                store["product_changes"] = {**snapshot["product_changes"], **store["product_changes"]}
+                self._forget_saving(store, snapshot["pending"])
+                store["dirty"] = True
+            raise
+
+        with store["lock"]:
+            pending, removed, changes = store["pending"], store["removed"], store["product_changes"]
+            self._read_published(store_key, store)
+            # Re-apply what changed while the matrix was being written
+            for url in removed:
+                self._discard(store, url)
+            store["pending"].update(pending)
+            for key, entry in changes.items():
+                if entry is None:
+                    store["products"].pop(key, None)
+                else:
+                    store["products"][key] = entry
+            store["product_changes"] = changes
+            self._forget_saving(store, snapshot["pending"])
+            store["dirty"] = bool(pending or removed or changes)
+
+    @staticmethod
+    def _forget_saving(store, saved):
+        """Drop rows of a finished save from `saving`, keeping those of a newer one."""
+        for url, emb in saved.items():
+            if store["saving"].get(url) is emb:
+                del store["saving"][url]
+
+    def _merged_rows(self, store, base, latest):
+        """
+        Combine the last published version with this process's changes.
+
+        Returns:
+            Tuple (vectors, products): vectors maps image URL to its
+            embeddings (views of the mapped matrices or pending arrays)
+        """
+        default_file = os.path.basename(base) + ".npy"
+        if latest is None or latest.get("vectors_file", default_file) == store["vectors_file"]:
+            # Nobody published since this process last read the store
+            vectors = {url: store["matrix"][row] for url, row in store["rows"].items()}
+            products = store["products"]
+        else:
+            # Another process published since: start from its version and re-apply our changes
+            latest_matrix = np.load(os.path.join(self.root, latest.get("vectors_file", default_file)), mmap_mode="r")
+            vectors = {
+                url: latest_matrix[row] for row, url in enumerate(latest["urls"]) if url not in store["removed"]
+            }
+            products = dict(latest.get("products", {}))
+            for key, entry in store["product_changes"].items():
+                if entry is None:
+                    products.pop(key, None)
+                else:
+                    products[key] = entry
+        vectors.update(store["pending"])
+        return vectors, products
+
+    def _publish(self, store_key, store, base, chunk_size):
+        """Write a new version of a store from a `save` snapshot; the caller holds the file lock."""
+        latest = self._read_sidecar(base)
+        vectors, products = self._merged_rows(store, base, latest)
+        urls = list(vectors)
+        version = max(store["version"], latest.get("version", 0) if latest else 0) + 1
+        # Unique name per save, so a file is never replaced while a sidecar points at it
+        vectors_file = f"{os.path.basename(base)}.v{version}.{uuid.uuid4().hex[:8]}.npy"
+        vectors_path = os.path.join(self.root, vectors_file)
+
+        with atomic_path(vectors_path) as tmp_path:
+            if urls:
+                # (views, D) per row: 3 views for multi-scale catalogs, fewer for single-view ones
+                row_shape = vectors[urls[0]].shape
+                matrix = np.lib.format.open_memmap(
+                    tmp_path, mode="w+", dtype=self.dtype, shape=(len(urls), *row_shape)
+                )
+                for start in range(0, len(urls), chunk_size):
+                    chunk = urls[start:start + chunk_size]
+                    matrix[start:start + len(chunk)] = np.stack([vectors[url] for url in chunk])
+                matrix.flush()
+                del matrix
+            else:
+                with open(tmp_path, "wb") as f:
+                    np.save(f, np.zeros((0, 3, 0), dtype=self.dtype))
+
+        meta = {
+            "store": store_key,
+            "model": self.model_name,
+            "preprocess_version": self.preprocess_version,
+            "backend": self.backend,
+            "version": version,
+            "saved_at": time.time(),
+            "dtype": self.dtype.name,
+            "vectors_file": vectors_file,
+            "urls": urls,
+            "products": products,
+        }
+        # The sidecar switch is the publish step
+        with atomic_open(base + ".json") as f:
+            json.dump(meta, f)
+
+        # Remove the file the replaced sidecar pointed at; processes still
+        # mapping it keep their mapping after unlink
+        previous_file = store["vectors_file"]
+        if latest is not None:
+            previous_file = latest.get("vectors_file", os.path.basename(base) + ".npy")
+        if previous_file and previous_file != vectors_file:
+            try:
+                os.remove(os.path.join(self.root, previous_file))
+            except OSError:
+                pass
+
+    def store_keys(self):
+        """List the store keys saved on disk for the current model, backend and preprocessing version."""
+        keys = []
+        for name in sorted(os.listdir(self.root)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.root, name), "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if (
+                meta.get("model") == self.model_name
+                and meta.get("preprocess_version") == self.preprocess_version
+                and meta.get("backend", "fp32") == self.backend
+            ):
+                keys.append(meta["store"])
+        return keys
+
+    def preload(self):
+        """
+        Load every store saved on disk (e.g. by the offline indexer) into memory.
+
+        Returns:
+            Number of stores loaded
+        """
+        keys = self.store_keys()
+        for store_key in keys:
+            with self._locked(store_key):
+                pass
+        return len(keys)
+
+    def stats(self):
+        """Return hit/miss counters and the number of cached embeddings."""
+        with self._lock:
+            stores = list(self._stores.values())
+        entries = 0
+        mapped_bytes = 0
+        for store in stores:
+            with store["lock"]:
+                entries += len(self._urls(store))
+                mapped_bytes += store["matrix"].nbytes if store["matrix"] is not None else 0
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": entries,
+                "stores": len(self._stores),
+                "dtype": self.dtype.name,
+                "mapped_bytes": mapped_bytes,
+            }
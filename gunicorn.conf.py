@@ -0,0 +1,43 @@
+"""
+Gunicorn settings for serving the app.
+
+Each worker process runs its own background search pool (SEARCH_WORKERS /
+SEARCH_QUEUE_SIZE) and threads for requests: each open progress stream holds
+one thread. Job state is written to JOBS_DIR, which all workers share, so a
+job's /results, /progress_stream and cancel requests can reach any worker.
+
+With preload_app the master imports the app and loads CLIP once; workers
+share the weights copy-on-write, so a restarted worker is ready without
+reloading them. Each worker builds the torchscript/onnx backend and warms
+the model up after the fork, before it accepts requests; the master never
+runs the model.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '7860')}"
+workers = int(os.environ.get("GUNICORN_WORKERS", 1))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 16))
+
+# Requests return quickly now that searches run in the background; with
+# gthread workers, long-lived progress streams do not trip this timeout.
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+graceful_timeout = 30
+keepalive = 5
+
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+
+def on_starting(server):
+    # Also catches -w/--workers or WEB_CONCURRENCY overriding the setting above
+    if server.cfg.workers > 1 and os.environ.get("JOBS_DIR") == "":
+        raise RuntimeError(
+            f"JOBS_DIR is empty, so search jobs stay in the memory of the worker that accepted "
+            f"them; set it to a shared directory to run {server.cfg.workers} workers"
+        )
+
+
+def post_worker_init(worker):
+    # Without preload_app this is the worker's own import of the app
+    from app import warmup
+    warmup()
@@ -0,0 +1,183 @@
+"""
+Local cache of downloaded product images, stored at thumbnail size.
+
+CLIP only sees 224px inputs, so each image is kept as a JPEG downscaled to
+`short_side` pixels on its shorter side instead of the full CDN original.
+The response's ETag/Last-Modified are stored next to it so stale entries
+can be revalidated with a conditional request instead of a full download.
+The directory is bounded by size and evicts the least recently used images.
+"""
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from atomic_file import atomic_open
+
+# Short side of stored images; leaves headroom above CLIP's 224px input for the center crop
+THUMBNAIL_SHORT_SIDE = 336
+
+
+def decode_image(content, short_side=THUMBNAIL_SHORT_SIDE):
+    """
+    Decode image bytes as RGB, downscaled so the short side is `short_side`.
+
+    JPEGs are decoded at a reduced scale with Pillow's draft mode, which
+    skips most of the decoding work for large originals.
+    """
+    image = Image.open(BytesIO(content))
+    width, height = image.size
+    scale = short_side / min(width, height)
+    if scale < 1:
+        target = (math.ceil(width * scale), math.ceil(height * scale))
+        if image.format == "JPEG":
+            # Decodes at the smallest 1/2, 1/4 or 1/8 scale that is still >= target
+            image.draft("RGB", target)
+        image = image.convert("RGB")
+        if image.size != target:
+            image = image.resize(target, Image.BICUBIC)
+        return image
+    return image.convert("RGB")
+
+
+class ImageCache:
+    """
+    Size-bounded directory of downscaled images keyed by URL.
+
+    Args:
+        root: Cache directory
+        max_bytes: Maximum total size of cached images
+        max_age: Seconds an entry is used without revalidating it
+        short_side: Short side of stored images in pixels
+        quality: JPEG quality of stored images
+    """
+
+    def __init__(self, root="image_cache", max_bytes=1024 * 1024 * 1024, max_age=24 * 3600,
+                 short_side=THUMBNAIL_SHORT_SIDE, quality=90):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.short_side = short_side
+        self.quality = quality
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._size = sum(
+            os.path.getsize(os.path.join(root, name)) for name in os.listdir(root) if name.endswith(".jpg")
+        )
+
+    def _base_path(self, url):
+        return os.path.join(self.root, hashlib.sha1(url.encode("utf-8")).hexdigest()[:20])
+
+    def lookup(self, url):
+        """
+        Return the cached entry for `url`.
+
+        Returns:
+            Tuple (image, validators, fresh) or None on a miss; validators
+            holds the stored etag and last_modified, and fresh is False once
+            the entry is older than max_age and should be revalidated
+        """
+        base = self._base_path(url)
+        try:
+            with open(base + ".json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("url") != url:
+                raise ValueError("hash collision")
+            image = Image.open(base + ".jpg")
+            image.load()
+            os.utime(base + ".jpg")
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        fresh = time.time() - meta.get("stored_at", 0) < self.max_age
+        if fresh:
+            with self._lock:
+                self.hits += 1
+        validators = {"etag": meta.get("etag"), "last_modified": meta.get("last_modified")}
+        return image.convert("RGB"), validators, fresh
+
+    def mark_revalidated(self, url):
+        """Record a 304 response: the cached image is current again."""
+        base = self._base_path(url)
+        try:
+            with open(base + ".json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            meta["stored_at"] = time.time()
+            self._write_json(base, meta)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            self.revalidated += 1
+
+    def store(self, url, image, etag=None, last_modified=None):
+        """Save a decoded (already downscaled) image with its HTTP validators."""
+        base = self._base_path(url)
+        try:
+            old_size = os.path.getsize(base + ".jpg") if os.path.exists(base + ".jpg") else 0
+            with atomic_open(base + ".jpg", "wb") as f:
+                image.save(f, "JPEG", quality=self.quality)
+            # Validators go last: a lookup only trusts an image that has its sidecar
+            self._write_json(base, {
+                "url": url,
+                "etag": etag,
+                "last_modified": last_modified,
+                "stored_at": time.time(),
+            })
+            new_size = os.path.getsize(base + ".jpg")
+        except OSError as e:
+            print(f"⚠️ Could not cache image {url}: {e}")
+            return
+
+        with self._lock:
+            self._size += new_size - old_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    @staticmethod
+    def _write_json(base, meta):
+        with atomic_open(base + ".json") as f:
+            json.dump(meta, f)
+
+    def _evict(self):
+        """Remove least recently used images down to 90% of max_bytes; the caller holds the lock."""
+        entries = []
+        for name in os.listdir(self.root):
+            if not name.endswith(".jpg"):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if self._size <= self.max_bytes * 0.9:
+                break
+            for file_path in (path, path[:-len(".jpg")] + ".json"):
+                try:
+                    os.remove(file_path)
+                except OSError:
+                    pass
+            self._size -= size
+
+    def stats(self):
+        """Return hit/revalidation/miss counters and the cache size."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "revalidated": self.revalidated,
+                "misses": self.misses,
+                "bytes": self._size,
+            }
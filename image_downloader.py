@@ -0,0 +1,119 @@
+"""
+Concurrent product image downloader.
+
+Images are fetched on a bounded thread pool through a pooled HTTP session,
+with a per-host concurrency cap so a single CDN is not hammered. Decoded
+images are yielded as soon as they arrive so embedding can start while the
+remaining downloads are still in flight. Each iteration keeps only a bounded
+window of downloads in flight, so a slow consumer does not make decoded
+images pile up and one large store does not hog the shared pool.
+
+With an ImageCache, images are served from disk and only revalidated with
+conditional requests once they are older than the cache's max_age.
+"""
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from image_cache import THUMBNAIL_SHORT_SIDE, decode_image
+
+
+class ImageDownloader:
+    """
+    Thread-pool image downloader sharing one keep-alive session.
+
+    Args:
+        max_workers: Maximum number of concurrent downloads overall
+        per_host_limit: Maximum number of concurrent downloads per host
+        timeout: Per-request timeout in seconds
+        cache: Optional ImageCache for downloaded images
+        window: Downloads kept in flight (or finished but not yet consumed) per
+            iter_images call; defaults to twice max_workers
+    """
+
+    def __init__(self, max_workers=16, per_host_limit=8, timeout=10, cache=None, window=None):
+        self.window = window or 2 * max_workers
+        self.timeout = timeout
+        self.per_host_limit = per_host_limit
+        self.cache = cache
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="img-download")
+        self._host_slots = {}
+        self._host_lock = threading.Lock()
+
+    def _host_semaphore(self, url):
+        host = urlparse(url).netloc
+        with self._host_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self._host_slots[host]
+
+    def fetch(self, url):
+        """Download and decode a single image as RGB, downscaled for embedding."""
+        cached = self.cache.lookup(url) if self.cache is not None else None
+        headers = {}
+        if cached is not None:
+            image, validators, fresh = cached
+            if fresh:
+                return image
+            if validators["etag"]:
+                headers["If-None-Match"] = validators["etag"]
+            if validators["last_modified"]:
+                headers["If-Modified-Since"] = validators["last_modified"]
+
+        with self._host_semaphore(url):
+            resp = self.session.get(url, timeout=self.timeout, headers=headers)
+            if resp.status_code == 304 and cached is not None:
+                self.cache.mark_revalidated(url)
+                return cached[0]
+            resp.raise_for_status()
+            content = resp.content
+
+        image = decode_image(content, self.cache.short_side if self.cache is not None else THUMBNAIL_SHORT_SIDE)
+        if self.cache is not None:
+            self.cache.store(url, image, resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+        return image
+
+    def iter_images(self, urls):
+        """
+        Download images concurrently, yielding them in completion order.
+
+        At most `window` downloads are submitted or held at a time; a new URL
+        is submitted as each result is yielded. Failed downloads are logged
+        and skipped.
+
+        Yields:
+            Tuples (url, PIL image)
+        """
+        remaining = iter(urls)
+        pending = {}
+
+        def submit_next():
+            for url in remaining:
+                pending[self._executor.submit(self.fetch, url)] = url
+                return
+
+        try:
+            for _ in range(self.window):
+                submit_next()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url = pending.pop(future)
+                    submit_next()
+                    try:
+                        image = future.result()
+                    except Exception as e:
+                        print(f"⚠️ Error downloading {url}: {e}")
+                        continue
+                    yield url, image
+        finally:
+            # Stop queued downloads if the consumer bails out early
+            for future in pending:
+                future.cancel()
@@ -1,12 +1,47 @@
 """
 Improved image matching algorithms for better product recommendations.
 """
+import math
 import torch
 import numpy as np
 from PIL import Image, ImageFilter, ImageEnhance
 from typing import List, Dict, Tuple
 import clip
 
+# Bump whenever the views produced by get_multi_scale_embeddings change,
+# so cached catalog embeddings from the old pipeline are not reused.
+# v2: product images are downscaled to a 336px short side before the views are built
+PREPROCESS_VERSION = "multiscale-v2"
+
+# Indices of the views built by _multi_scale_views
+ALL_VIEWS = (0, 1, 2)
+ORIGINAL_VIEW = (0,)
+DETAIL_VIEWS = (1, 2)
+
+
+def _multi_scale_views(image, views=ALL_VIEWS):
+    """
+    Build the views used for multi-scale matching:
+    original, center crop (focus on main object) and enhanced contrast
+    (helps with lighting differences).
+
+    `views` selects which of the three to build, by index.
+    """
+    result = []
+    for view in views:
+        if view == 0:
+            result.append(image)
+        elif view == 1:
+            width, height = image.size
+            min_dim = min(width, height)
+            left = (width - min_dim) // 2
+            top = (height - min_dim) // 2
+            result.append(image.crop((left, top, left + min_dim, top + min_dim)))
+        else:
+            result.append(ImageEnhance.Contrast(image).enhance(1.5))
+    return result
+
+
 def get_multi_scale_embeddings(image, model, preprocess, device):
     """
     Extract embeddings at multiple scales for better matching.
@@ -14,33 +49,78 @@ def get_multi_scale_embeddings(image, model, preprocess, device):
     """
     embeddings = []
 
-    # Original image
-    img_input = preprocess(image).unsqueeze(0).to(device)
-    with torch.no_grad():
-        emb = model.encode_image(img_input)
-        embeddings.append(emb / emb.norm(dim=-1, keepdim=True))
+    for view in _multi_scale_views(image):
+        img_input = preprocess(view).unsqueeze(0).to(device)
+        with torch.no_grad():
+            emb = model.encode_image(img_input)
+            embeddings.append(emb / emb.norm(dim=-1, keepdim=True))
 
-    # Center crop (focus on main object)
-    width, height = image.size
-    min_dim = min(width, height)
-    left = (width - min_dim) // 2
-    top = (height - min_dim) // 2
-    center_crop = image.crop((left, top, left + min_dim, top + min_dim))
+    return embeddings
 
-    img_input = preprocess(center_crop).unsqueeze(0).to(device)
-    with torch.no_grad():
-        emb = model.encode_image(img_input)
-        embeddings.append(emb / emb.norm(dim=-1, keepdim=True))
 
-    # Enhanced contrast version (helps with lighting differences)
-    enhancer = ImageEnhance.Contrast(image)
-    contrast_img = enhancer.enhance(1.5)
-    img_input = preprocess(contrast_img).unsqueeze(0).to(device)
-    with torch.no_grad():
-        emb = model.encode_image(img_input)
-        embeddings.append(emb / emb.norm(dim=-1, keepdim=True))
+def get_multi_scale_embeddings_batch(images, model, preprocess, device, batch_size=32, views=ALL_VIEWS):
+    """
+    Batched version of get_multi_scale_embeddings for many images.
 
-    return embeddings
+    Builds all 3N views, preprocesses them and encodes them in chunks of
+    `batch_size` so the model sees real batches instead of one image at a time.
+
+    Args:
+        images: List of PIL images
+        batch_size: Number of views encoded per forward pass
+        views: Indices of the views to embed (see _multi_scale_views)
+
+    Returns:
+        Tensor of shape (N, len(views), D) with L2-normalized embeddings,
+        views ordered as original, center crop, contrast
+    """
+    if not images:
+        return torch.empty((0, len(views), model.visual.output_dim), device=device)
+
+    view_images = [view for image in images for view in _multi_scale_views(image, views)]
+
+    chunks = []
+    for start in range(0, len(view_images), batch_size):
+        batch = torch.stack([preprocess(v) for v in view_images[start:start + batch_size]]).to(device)
+        with torch.no_grad():
+            emb = model.encode_image(batch)
+        chunks.append(emb / emb.norm(dim=-1, keepdim=True))
+
+    embeddings = torch.cat(chunks)
+    return embeddings.view(len(images), len(views), -1)
+
+
+def iter_multi_scale_embeddings(items, model, preprocess, device, batch_size=32, views=ALL_VIEWS):
+    """
+    Embed a stream of images in batches as they arrive.
+
+    Images are buffered until their views fill whole batches of `batch_size`
+    views, so a producer (e.g. a concurrent downloader) can keep working
+    while the model encodes the previous batch. With the inference scheduler
+    every forward pass is then a full batch and never waits for more rows
+    (e.g. 32 images = 96 views = 3 passes of 32 for all three views).
+
+    Args:
+        items: Iterable of (key, PIL image) tuples
+
+    Yields:
+        Tuples (keys, embeddings) where embeddings has shape (len(keys), len(views), D)
+    """
+    # Smallest image count whose views are a multiple of batch_size
+    images_per_batch = batch_size // math.gcd(batch_size, len(views))
+    keys = []
+    images = []
+
+    for key, image in items:
+        keys.append(key)
+        images.append(image)
+        if len(images) >= images_per_batch:
+            yield keys, get_multi_scale_embeddings_batch(images, model, preprocess, device, batch_size, views)
+            keys = []
+            images = []
+
+    if images:
+        yield keys, get_multi_scale_embeddings_batch(images, model, preprocess, device, batch_size, views)
 
 
 def compute_advanced_similarity(query_embeddings, product_embeddings):
@@ -79,6 +159,71 @@ def compute_advanced_similarity(query_embeddings, product_embeddings):
     return final_score
 
 
+def compute_advanced_similarity_batch(query_embeddings, product_embeddings, top_k=None):
+    """
+    Vectorized compute_advanced_similarity over a whole candidate matrix.
+
+    All 9 query/product view similarities for every product come from one
+    matmul, followed by max/mean/min reductions with the same 0.5/0.35/0.15
+    weights, so scores match the per-product version.
+
+    Args:
+        query_embeddings: (3, D) tensor or list of (1, D) tensors
+        product_embeddings: (N, 3, D) tensor
+        top_k: If set, only return the best `top_k` products
+
+    Returns:
+        Tuple (scores, indices): (N,) float64 scores for every product and the
+        indices of the best products sorted by descending score
+    """
+    if isinstance(query_embeddings, (list, tuple)):
+        query_embeddings = torch.cat(query_embeddings)
+
+    query = query_embeddings.float()
+    products = product_embeddings.to(query.device).float()
+    query = query / query.norm(dim=-1, keepdim=True)
+    products = products / products.norm(dim=-1, keepdim=True)
+
+    # (N, 3, D) x (D, 3) -> (N, 3, 3), flattened to the 9 pairwise similarities
+    similarities = torch.matmul(products, query.T).flatten(1).double()
+
+    scores = (
+        0.5 * similarities.max(dim=1).values +
+        0.35 * similarities.mean(dim=1) +
+        0.15 * similarities.min(dim=1).values
+    )
+
+    k = len(scores) if top_k is None else min(top_k, len(scores))
+    indices = torch.topk(scores, k).indices
+    return scores, indices
+
+
+def cascade_recall(query_embeddings, product_embeddings, k, candidate_counts):
+    """
+    Recall@k of the cascade's first stage against full multi-scale scoring.
+
+    The first stage scores products by their original view only and keeps
+    the best M; this measures which share of the true top k (scored with all
+    views) survives that cut, for each M in `candidate_counts`.
+
+    Args:
+        query_embeddings: (3, D) tensor or list of (1, D) tensors
+        product_embeddings: (N, 3, D) tensor
+        k: Number of results that must survive the first stage
+        candidate_counts: Values of M to evaluate
+
+    Returns:
+        Dictionary mapping each M (as a string) to recall@k in [0, 1]
+    """
+    _, full_top = compute_advanced_similarity_batch(query_embeddings, product_embeddings, top_k=k)
+    _, first_stage = compute_advanced_similarity_batch(query_embeddings, product_embeddings[:, :1])
+    truth = set(full_top.tolist())
+    if not truth:
+        return {}
+    first_stage = first_stage.tolist()
+    return {str(m): round(len(truth & set(first_stage[:m])) / len(truth), 4) for m in candidate_counts}
+
+
 def extract_color_features(image):
     """
     Extract dominant colors from image for color-based filtering/boosting.
@@ -115,19 +260,36 @@ def color_similarity_boost(query_features, product_features):
     return max(0, color_similarity)
 
 
-def rerank_with_diversity(results, top_k=5, diversity_weight=0.3):
+def rerank_with_diversity(results, top_k=5, diversity_weight=0.3, method="names", embeddings=None,
+                          name_weight=0.0):
     """
     Re-rank results to balance similarity with diversity.
     Prevents returning 5 very similar items.
+
+    Args:
+        results: Result dictionaries with 'product' and 'score', best first
+        top_k: Number of results to return
+        diversity_weight: Weight of the diversity penalty
+        method: "names" penalizes shared words in product names; "mmr" uses
+            embedding-based Maximal Marginal Relevance (see rerank_mmr)
+        embeddings: (N, V, D) or (N, D) embeddings aligned with `results`
+            (required for "mmr")
+        name_weight: Weight of the name-overlap penalty added by "mmr"
     """
+    if method not in ("names", "mmr"):
+        raise ValueError(f"Unknown re-ranking method: {method}")
     if len(results) <= top_k:
         return results
 
-    selected = []
-    remaining = results.copy()
+    if method == "mmr":
+        if embeddings is None:
+            raise ValueError("MMR re-ranking needs the result embeddings")
+        return rerank_mmr(results, embeddings, top_k, diversity_weight, name_weight)
 
-    # Always take the top result
-    selected.append(remaining.pop(0))
+    # Split names once instead of for every candidate/selected pair
+    tokens = [set(r['product']['name'].lower().split()) for r in results]
+    selected = [0]
+    remaining = list(range(1, len(results)))
 
     while len(selected) < top_k and remaining:
         best_score = -float('inf')
@@ -135,15 +297,10 @@ def rerank_with_diversity(results, top_k=5, diversity_weight=0.3):
 
         for idx, candidate in enumerate(remaining):
             # Original similarity score
-            sim_score = candidate['score']
+            sim_score = results[candidate]['score']
 
-            # Diversity penalty (how different from already selected)
-            diversity_penalty = 0
-            for selected_item in selected:
-                # Simple diversity: penalize if product names are too similar
-                name_overlap = len(set(candidate['product']['name'].lower().split()) &
-                                  set(selected_item['product']['name'].lower().split()))
-                diversity_penalty += name_overlap / 10  # Normalize
+            # Diversity penalty: penalize if product names are too similar
+            diversity_penalty = sum(len(tokens[candidate] & tokens[s]) for s in selected) / 10
 
             # Combined score
             combined = sim_score - (diversity_weight * diversity_penalty)
@@ -154,7 +311,83 @@ def rerank_with_diversity(results, top_k=5, diversity_weight=0.3):
 
         selected.append(remaining.pop(best_idx))
 
-    return selected
+    return [results[i] for i in selected]
+
+
+def name_token_index(results):
+    """
+    Precompute the name tokens of results for the MMR name-overlap penalty.
+
+    Returns:
+        Tuple (token_ids, postings): the token ids of each result's name, and
+        for each token id the array of results whose name contains it
+    """
+    vocabulary = {}
+    token_ids = []
+    postings = []
+    for i, r in enumerate(results):
+        ids = []
+        for token in set(r['product']['name'].lower().split()):
+            token_id = vocabulary.setdefault(token, len(vocabulary))
+            if token_id == len(postings):
+                postings.append([])
+            postings[token_id].append(i)
+            ids.append(token_id)
+        token_ids.append(ids)
+    return token_ids, [np.asarray(p) for p in postings]
+
+
+def rerank_mmr(results, embeddings, top_k=5, diversity_weight=0.3, name_weight=0.0, name_tokens=None):
+    """
+    Maximal Marginal Relevance re-ranking over product embeddings.
+
+    Each step picks the result maximizing
+    score - diversity_weight * max cosine similarity to the already selected
+    results - name_weight * shared name words with them / 10.
+    The max-similarity and name-overlap vectors are updated incrementally,
+    so a step costs one matrix-vector product over the candidates.
+
+    Args:
+        results: Result dictionaries with 'score', best first
+        embeddings: (N, V, D) or (N, D) embeddings aligned with `results`;
+            multi-view embeddings are averaged
+        name_tokens: Output of name_token_index(results), computed when
+            name_weight is set and it is not given
+
+    Returns:
+        The top_k selected results, in selection order
+    """
+    if len(results) <= top_k:
+        return results
+
+    vectors = torch.as_tensor(np.asarray(embeddings), dtype=torch.float32)
+    if vectors.dim() == 3:
+        vectors = vectors.mean(dim=1)
+    vectors = vectors / vectors.norm(dim=-1, keepdim=True).clamp_min(1e-12)
+
+    scores = torch.tensor([r['score'] for r in results], dtype=torch.float32)
+    max_similarity = torch.zeros(len(results))
+    name_overlap = np.zeros(len(results), dtype=np.float32)
+    if name_weight and name_tokens is None:
+        name_tokens = name_token_index(results)
+
+    selected = []
+    available = torch.ones(len(results), dtype=torch.bool)
+    for _ in range(top_k):
+        combined = scores - diversity_weight * max_similarity
+        if name_weight:
+            combined -= name_weight * torch.from_numpy(name_overlap) / 10
+        best = int(torch.where(available, combined, torch.tensor(-float('inf'))).argmax())
+        selected.append(best)
+        available[best] = False
+
+        max_similarity = torch.maximum(max_similarity, vectors @ vectors[best])
+        if name_weight:
+            token_ids, postings = name_tokens
+            for token_id in token_ids[best]:
+                name_overlap[postings[token_id]] += 1
+
+    return [results[i] for i in selected]
 
 
 def get_text_embedding(text, model, device):
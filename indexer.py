@@ -0,0 +1,226 @@
+"""
+Offline bulk indexer: pre-embed store catalogs outside of /search.
+
+Each store is scraped, its new or changed product images are downloaded
+concurrently and embedded in batches as they arrive (Shopify listings a
+page at a time, while the next pages are fetched), and the result is
+saved to the embedding catalog the app loads at startup. Stores are spread
+over a pool of worker processes, each with its own CLIP model.
+
+Usage:
+    python indexer.py bouldergear.com allbirds.com/collections/mens
+    python indexer.py --stores-file stores.txt --workers 2 --catalog-dir catalog
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+DEFAULT_MODEL_NAME = "ViT-B/32"
+
+# Per-process state set up by _init_worker
+_worker = {}
+
+
+def _init_worker(model_name, weights, backend, catalog_dir, catalog_dtype, batch_size, download_workers,
+                 image_cache_dir, torch_threads):
+    """Load CLIP and the shared helpers once per worker process."""
+    import torch
+
+    from embedding_catalog import EmbeddingCatalog
+    from image_cache import ImageCache
+    from image_downloader import ImageDownloader
+    from inference_backends import load_backend, load_clip_model
+    from improved_matcher import PREPROCESS_VERSION
+    from scraper_registry import default_registry
+
+    torch.set_num_threads(torch_threads)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model, preprocess = load_clip_model(
+        model_name, device, weights=weights, download_root=os.environ.get("CLIP_DOWNLOAD_ROOT")
+    )
+    encoder = load_backend(backend, model, device, model_name)
+
+    _worker.update(
+        model=encoder,
+        preprocess=preprocess,
+        device=device,
+        batch_size=batch_size,
+        catalog=EmbeddingCatalog(
+            root=catalog_dir, model_name=model_name, preprocess_version=PREPROCESS_VERSION, dtype=catalog_dtype,
+            backend=encoder.name
+        ),
+        downloader=ImageDownloader(
+            max_workers=download_workers,
+            cache=ImageCache(root=image_cache_dir) if image_cache_dir else None
+        ),
+        # Whole collections: the indexer is where full stores get embedded
+        scrapers=default_registry(shopify_max_products=None),
+    )
+    print(f"✅ Indexer worker {os.getpid()} ready on {device}")
+
+
+def _embed_missing(store_key, img_urls):
+    """
+    Download and embed images missing from the catalog and add them to it.
+
+    Returns:
+        Dictionary mapping image URL to its (3, D) embeddings
+    """
+    from improved_matcher import iter_multi_scale_embeddings
+
+    catalog = _worker["catalog"]
+    missing = list(dict.fromkeys(img_urls))
+    embedded = {}
+    embedding_stream = iter_multi_scale_embeddings(
+        _worker["downloader"].iter_images(missing),
+        _worker["model"], _worker["preprocess"], _worker["device"], batch_size=_worker["batch_size"]
+    )
+    for batch_urls, batch_embeddings in embedding_stream:
+        batch_embeddings = batch_embeddings.float().cpu().numpy()
+        catalog.add(store_key, batch_urls, batch_embeddings)
+        embedded.update(zip(batch_urls, batch_embeddings))
+        if len(embedded) % 500 < len(batch_urls):
+            print(f"   {store_key}: embedded {len(embedded)}/{len(missing)}")
+    return embedded
+
+
+def index_store(url, index_kind=None, index_min_products=2000):
+    """
+    Scrape one store/collection and embed every product missing from the catalog.
+
+    Shopify listings are embedded page by page while later pages are still
+    being fetched; other stores are scraped in full first.
+
+    Runs in a worker process set up by _init_worker.
+
+    Returns:
+        Dictionary with the store key, sync counts, embedded count and elapsed time
+    """
+    from catalog_sync import refresh_shopify_collection
+    from embedding_catalog import catalog_key
+    from scraper_registry import normalize_url
+    from scraper_shopify import shopify_source
+
+    start = time.time()
+    catalog = _worker["catalog"]
+    adapter = _worker["scrapers"].resolve(url)
+
+    if adapter.name == "shopify":
+        store_url, collection = adapter.collection(url)
+        store_key = catalog_key(shopify_source(store_url, collection))
+        report = refresh_shopify_collection(store_url, collection, catalog, _embed_missing)
+        embedded = report.pop("embedded")
+        products = report.pop("products")
+        report.pop("seconds")
+    else:
+        scraper_result = adapter.scrape(normalize_url(url))
+        products = len(scraper_result.get("products", []))
+        store_key = catalog_key(scraper_result.get("source", url))
+        if not products:
+            # An empty scrape is more likely a blocked page than an empty store: leave its catalog alone
+            return {"url": url, "store": store_key, "products": 0, "embedded": 0,
+                    "seconds": round(time.time() - start, 2)}
+
+        report = catalog.sync_products(
+            store_key, scraper_result["products"], complete=scraper_result.get("complete", False)
+        )
+        _, missing = catalog.lookup(
+            store_key, [p["img_url"] for p in scraper_result["products"]], count=False
+        )
+        print(f"📦 {store_key}: {products} products, {len(set(missing))} images to embed")
+        try:
+            embedded = len(_embed_missing(store_key, missing))
+        finally:
+            # Publish partial progress on Ctrl-C or errors; rerunning the indexer resumes from it
+            catalog.save(store_key)
+
+    if index_kind and products > index_min_products:
+        catalog.vector_index(store_key, kind=index_kind)
+        catalog.save(store_key)
+
+    return {
+        "url": url,
+        "store": store_key,
+        "scraper": adapter.name,
+        "products": products,
+        "embedded": embedded,
+        **report,
+        "seconds": round(time.time() - start, 2),
+    }
+
+
+def _read_stores(args):
+    urls = list(args.stores)
+    if args.stores_file:
+        with open(args.stores_file, "r", encoding="utf-8") as f:
+            urls.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+    return list(dict.fromkeys(urls))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-embed store catalogs for the visual search app.")
+    parser.add_argument("stores", nargs="*", help="Store URLs or store/collection URLs")
+    parser.add_argument("--stores-file", help="File with one store URL per line (# for comments)")
+    parser.add_argument("--workers", type=int, default=2, help="Worker processes, each with its own CLIP model")
+    parser.add_argument("--catalog-dir", default=os.environ.get("CATALOG_DIR", "catalog"))
+    parser.add_argument("--dtype", default=os.environ.get("CATALOG_DTYPE", "float32"), choices=["float32", "float16"],
+                        help="Storage dtype of catalog vectors")
+    parser.add_argument("--image-cache-dir", default=os.environ.get("IMAGE_CACHE_DIR", "image_cache"),
+                        help="Downloaded-image cache shared with the app (empty to disable)")
+    parser.add_argument("--model", default=DEFAULT_MODEL_NAME, help="CLIP model name")
+    parser.add_argument("--weights", default=os.environ.get("CLIP_WEIGHTS"),
+                        help="Local CLIP weights file for --model (downloaded when omitted)")
+    parser.add_argument("--backend", default=os.environ.get("INFERENCE_BACKEND", "fp32"),
+                        choices=["fp32", "int8", "torchscript", "onnx"],
+                        help="Image encoder backend; must match the app's to share its catalog")
+    parser.add_argument("--batch-size", type=int, default=int(os.environ.get("EMBED_BATCH_SIZE", 32)),
+                        help="Image views per CLIP forward pass")
+    parser.add_argument("--download-workers", type=int, default=16, help="Concurrent downloads per worker")
+    parser.add_argument("--index-kind", default=os.environ.get("ANN_INDEX_KIND", "ivf"),
+                        help="Vector index built for large stores (empty to skip)")
+    parser.add_argument("--index-min-products", type=int, default=int(os.environ.get("ANN_MIN_PRODUCTS", 2000)))
+    args = parser.parse_args(argv)
+
+    urls = _read_stores(args)
+    if not urls:
+        parser.error("no stores given")
+
+    workers = max(1, min(args.workers, len(urls)))
+    torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    print(f"🚀 Indexing {len(urls)} stores with {workers} workers ({torch_threads} torch threads each)")
+
+    start = time.time()
+    failures = 0
+    # Spawn rather than fork: CUDA and torch's thread pools do not survive a fork
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(args.model, args.weights, args.backend, args.catalog_dir, args.dtype, args.batch_size,
+                  args.download_workers, args.image_cache_dir or None, torch_threads)
+    ) as executor:
+        futures = {
+            executor.submit(index_store, url, args.index_kind or None, args.index_min_products): url
+            for url in urls
+        }
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                report = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"❌ Failed to index {url}: {e}")
+                continue
+            print(
+                f"✅ {report['store']}: {report['products']} products, {report['embedded']} embedded "
+                f"in {report['seconds']}s"
+            )
+
+    print(f"🏁 Indexed {len(urls) - failures}/{len(urls)} stores in {time.time() - start:.1f}s")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
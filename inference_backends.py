@@ -0,0 +1,299 @@
+"""
+Inference backends for the CLIP image encoder.
+
+- fp32: the eager model as loaded by clip.load
+- int8: Linear layers dynamically quantized to int8 (CPU only)
+- torchscript: the image encoder traced and frozen into a TorchScript graph
+- onnx: the image encoder exported to ONNX and run with ONNX Runtime (if installed)
+
+Every backend returns an encoder with the model's `encode_image` and
+`visual` attributes, so it can be handed to the inference scheduler or the
+embedding helpers in place of the model. Embeddings differ slightly between
+backends, so the backend name is part of the embedding catalog's identity.
+
+load_clip_model loads the CLIP weights themselves, for the app and the
+offline indexer alike.
+
+Run this module to compare a backend against fp32:
+
+    python inference_backends.py --backend int8 --images path/to/images
+"""
+import argparse
+import copy
+import os
+import ssl
+import threading
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+BACKENDS = ("fp32", "int8", "torchscript", "onnx")
+# Backends whose build runs the model (tracing/export) or starts thread pools;
+# load_backend(defer=True) builds them on first use instead
+DEFERRED_BACKENDS = ("torchscript", "onnx")
+
+# Exported ONNX graphs are kept here between runs
+ONNX_CACHE_DIR = os.environ.get("ONNX_CACHE_DIR", "models")
+
+
+def load_clip_model(model_name, device, weights=None, download_root=None):
+    """
+    Load CLIP from a pinned weights file, the local download cache or, as a
+    last resort, the network.
+
+    Args:
+        model_name: CLIP model name (e.g. "ViT-B/32")
+        device: Device to load the model on
+        weights: Local weights file (e.g. a copy of ViT-B-32.pt); when set,
+            no network access is needed
+        download_root: Where downloaded weights are cached (clip's default when None)
+
+    Returns:
+        Tuple (model, preprocess)
+    """
+    import clip
+
+    if weights:
+        if not os.path.exists(weights):
+            raise FileNotFoundError(f"CLIP weights file not found: {weights}")
+        print(f"Loading CLIP weights from {weights}")
+        return clip.load(weights, device=device)
+
+    download_root = download_root or os.path.expanduser("~/.cache/clip")
+    cached = os.path.join(download_root, os.path.basename(clip.clip._MODELS[model_name]))
+    if not os.path.exists(cached):
+        # Handle SSL certificate issues for CLIP model download
+        print(f"Downloading CLIP weights to {download_root}")
+        ssl._create_default_https_context = ssl._create_unverified_context
+    return clip.load(model_name, device=device, download_root=download_root)
+
+
+class ImageEncoder:
+    """
+    Wraps a compiled image encoder behind the model's `encode_image` interface.
+
+    Args:
+        name: Backend name
+        forward: Callable mapping a preprocessed (N, 3, H, W) batch to (N, D)
+            embeddings, or None to create it with `build` on first use
+        visual: The original image encoder module (used for `output_dim`)
+        build: Callable returning `forward`, for deferred backends
+    """
+
+    def __init__(self, name, forward, visual, build=None):
+        self.name = name
+        self._forward = forward
+        self._build = build
+        self._build_lock = threading.Lock()
+        self.visual = visual
+
+    def build(self):
+        """Build a deferred backend now (no-op once built)."""
+        with self._build_lock:
+            if self._forward is None:
+                self._forward = self._build()
+        return self
+
+    def encode_image(self, images):
+        if self._forward is None:
+            self.build()
+        return self._forward(images)
+
+
+def _quantize_int8(model, device):
+    if device != "cpu":
+        raise RuntimeError("int8 dynamic quantization only runs on CPU")
+    visual = torch.ao.quantization.quantize_dynamic(model.visual.float().eval(), {torch.nn.Linear}, dtype=torch.qint8)
+    return ImageEncoder("int8", lambda images: visual(images.float()), model.visual)
+
+
+def _trace_torchscript(model, device, image_size):
+    visual = model.visual.eval()
+    dtype = next(visual.parameters()).dtype
+    example = torch.randn(1, 3, image_size, image_size, device=device, dtype=dtype)
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(visual, example))
+        # Run the graph optimizations once up front instead of on the first search
+        for _ in range(2):
+            traced(example)
+    return ImageEncoder("torchscript", lambda images: traced(images.type(dtype)), model.visual)
+
+
+def _import_onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError:
+        raise RuntimeError("The onnx backend needs onnxruntime (pip install onnxruntime)")
+    return onnxruntime
+
+
+def _export_onnx(model, device, image_size, model_name):
+    onnxruntime = _import_onnxruntime()
+
+    os.makedirs(ONNX_CACHE_DIR, exist_ok=True)
+    path = os.path.join(ONNX_CACHE_DIR, f"{model_name.replace('/', '-')}-visual-{image_size}.onnx")
+    visual = copy.deepcopy(model.visual).float().eval()
+    if not os.path.exists(path):
+        print(f"📦 Exporting image encoder to {path} ...")
+        example = torch.randn(1, 3, image_size, image_size, device=device)
+        with torch.no_grad():
+            torch.onnx.export(
+                visual, example, path + ".tmp",
+                input_names=["images"], output_names=["embeddings"],
+                dynamic_axes={"images": {0: "batch"}, "embeddings": {0: "batch"}},
+                opset_version=17
+            )
+        os.replace(path + ".tmp", path)
+
+    providers = ["CPUExecutionProvider"]
+    if device == "cuda":
+        providers.insert(0, "CUDAExecutionProvider")
+    session = onnxruntime.InferenceSession(path, providers=providers)
+
+    def forward(images):
+        outputs = session.run(None, {"images": images.float().cpu().numpy()})[0]
+        return torch.from_numpy(outputs).to(images.device)
+
+    return ImageEncoder("onnx", forward, model.visual)
+
+
+def load_backend(name, model, device, model_name="ViT-B/32", image_size=224, defer=False):
+    """
+    Build the image encoder for a backend.
+
+    Args:
+        name: One of BACKENDS
+        model: CLIP model from clip.load (int8 and onnx convert its image encoder to fp32)
+        device: Device the model runs on
+        model_name: CLIP model name, used to name exported graphs
+        image_size: Input resolution of the model
+        defer: Build DEFERRED_BACKENDS on first use (or ImageEncoder.build)
+            rather than now, e.g. so a process that forks workers never runs
+            the model itself; availability is still checked now
+
+    Raises:
+        ValueError: For unknown backends
+        RuntimeError: When the backend is not available on this machine
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {name} (choose from {', '.join(BACKENDS)})")
+    if defer and name in DEFERRED_BACKENDS:
+        if name == "onnx":
+            _import_onnxruntime()
+        return ImageEncoder(
+            name, None, model.visual,
+            build=lambda: load_backend(name, model, device, model_name, image_size)._forward
+        )
+    start = time.time()
+    if name == "fp32":
+        encoder = ImageEncoder("fp32", model.encode_image, model.visual)
+    elif name == "int8":
+        encoder = _quantize_int8(model, device)
+    elif name == "torchscript":
+        encoder = _trace_torchscript(model, device, image_size)
+    else:
+        encoder = _export_onnx(model, device, image_size, model_name)
+    print(f"⚙️ {name} inference backend ready in {time.time() - start:.1f}s")
+    return encoder
+
+
+def reference_images(count=16, size=256, seed=0):
+    """
+    Fixed set of synthetic images (random color blocks) for accuracy checks
+    when no real product images are at hand.
+    """
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        pixels = np.full((size, size, 3), rng.integers(0, 256, 3), dtype=np.uint8)
+        for _ in range(6):
+            x0, y0 = rng.integers(0, size - 32, 2)
+            w, h = rng.integers(32, size // 2, 2)
+            pixels[y0:y0 + h, x0:x0 + w] = rng.integers(0, 256, 3)
+        images.append(Image.fromarray(pixels))
+    return images
+
+
+def load_images(directory, limit=64):
+    """Load up to `limit` images from a directory, in name order."""
+    images = []
+    for name in sorted(os.listdir(directory)):
+        if len(images) >= limit:
+            break
+        try:
+            images.append(Image.open(os.path.join(directory, name)).convert("RGB"))
+        except Exception:
+            continue
+    return images
+
+
+def check_accuracy(reference, candidate, images, preprocess, device, top_k=5):
+    """
+    Compare a backend's embeddings and rankings with a reference backend.
+
+    Each image is used as a query against the whole set with the multi-scale
+    score, and the top-k results of both backends are compared.
+
+    Returns:
+        Dictionary with the min/mean cosine similarity of the view embeddings,
+        the mean top-k overlap, the top-1 agreement and the maximum score
+        difference
+    """
+    from improved_matcher import compute_advanced_similarity_batch, get_multi_scale_embeddings_batch
+
+    with torch.no_grad():
+        expected = get_multi_scale_embeddings_batch(images, reference, preprocess, device).float().cpu()
+        actual = get_multi_scale_embeddings_batch(images, candidate, preprocess, device).float().cpu()
+
+    cosine = (expected * actual).sum(dim=-1)
+    k = min(top_k, len(images))
+    overlaps = []
+    top1_agree = 0
+    max_score_diff = 0.0
+    for i in range(len(images)):
+        expected_scores, expected_top = compute_advanced_similarity_batch(expected[i], expected, top_k=k)
+        actual_scores, actual_top = compute_advanced_similarity_batch(actual[i], actual, top_k=k)
+        overlaps.append(len(set(expected_top.tolist()) & set(actual_top.tolist())) / k)
+        top1_agree += int(expected_top[0] == actual_top[0])
+        max_score_diff = max(max_score_diff, float((expected_scores - actual_scores).abs().max()))
+
+    return {
+        "images": len(images),
+        "min_cosine": round(float(cosine.min()), 5),
+        "mean_cosine": round(float(cosine.mean()), 5),
+        f"top{k}_overlap": round(float(np.mean(overlaps)), 4),
+        "top1_agreement": round(top1_agree / len(images), 4),
+        "max_score_diff": round(max_score_diff, 5),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare a CLIP inference backend with fp32.")
+    parser.add_argument("--backend", choices=BACKENDS, default="int8")
+    parser.add_argument("--model", default="ViT-B/32", help="CLIP model name")
+    parser.add_argument("--images", help="Directory of images to compare on (synthetic images when omitted)")
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model, preprocess = load_clip_model(
+        args.model, device, weights=os.environ.get("CLIP_WEIGHTS"), download_root=os.environ.get("CLIP_DOWNLOAD_ROOT")
+    )
+    images = load_images(args.images) if args.images else reference_images()
+
+    reference = load_backend("fp32", model, device, args.model)
+    candidate = load_backend(args.backend, model, device, args.model)
+    for name, encoder in (("fp32", reference), (args.backend, candidate)):
+        start = time.time()
+        with torch.no_grad():
+            encoder.encode_image(torch.stack([preprocess(image) for image in images]).to(device))
+        print(f"⏱️ {name}: {(time.time() - start) / len(images) * 1000:.1f} ms/image")
+
+    report = check_accuracy(reference, candidate, images, preprocess, device, top_k=args.top_k)
+    print(f"📊 {args.backend} vs fp32: {report}")
+
+
+if __name__ == "__main__":
+    main()
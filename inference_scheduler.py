@@ -0,0 +1,221 @@
+"""
+Cross-request micro-batching for the CLIP image encoder.
+
+A single scheduler thread owns the model. Request threads submit already
+preprocessed image tensors and get futures back; the scheduler groups rows
+from all pending requests into micro-batches of up to `max_batch_size`,
+waiting at most `max_wait_ms` for a batch to fill. Lower priority values
+are served first, so query images jump ahead of bulk catalog embedding.
+
+`client(priority)` returns an object with the model's `encode_image` and
+`visual` attributes, so the embedding helpers in improved_matcher.py work
+with it unchanged.
+
+The scheduler thread starts on first use (and again in a forked child), so
+the scheduler can be created before gunicorn forks its workers.
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+# Lower runs first
+PRIORITY_QUERY = 0
+PRIORITY_BULK = 10
+
+
+class _Request:
+    def __init__(self, images, priority):
+        self.images = images
+        self.priority = priority
+        self.offset = 0
+        self.parts = []
+        self.future = Future()
+        self.submitted_at = time.time()
+
+    @property
+    def remaining(self):
+        return len(self.images) - self.offset
+
+
+class InferenceClient:
+    """Model stand-in that encodes through the scheduler at a fixed priority."""
+
+    def __init__(self, scheduler, priority):
+        self.scheduler = scheduler
+        self.priority = priority
+
+    @property
+    def visual(self):
+        return self.scheduler.model.visual
+
+    def encode_image(self, images):
+        return self.scheduler.submit(images, priority=self.priority).result()
+
+
+class InferenceScheduler:
+    """
+    Single-threaded owner of the image encoder, batching requests across jobs.
+
+    Args:
+        model: CLIP model (anything with encode_image)
+        max_batch_size: Maximum number of images per forward pass
+        max_wait_ms: Longest a batch waits to fill up once its first image is queued
+        torch_threads: Intra-op threads for the model (None leaves torch's default)
+    """
+
+    def __init__(self, model, max_batch_size=32, max_wait_ms=10, torch_threads=None):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue = []
+        self._sequence = itertools.count()
+        self._queued_rows = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._batches = 0
+        self._rows = 0
+        self._batch_sizes = {}
+        self._rows_by_priority = {}
+        self._waits = 0
+        self._wait_ms_total = 0.0
+        self._max_wait_ms_seen = 0.0
+        self.torch_threads = torch_threads
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        """Start the scheduler thread in this process; the caller holds the lock."""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        if self.torch_threads:
+            torch.set_num_threads(self.torch_threads)
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._loop, name="inference-scheduler", daemon=True)
+        self._thread.start()
+
+    def client(self, priority=PRIORITY_BULK):
+        return InferenceClient(self, priority)
+
+    def submit(self, images, priority=PRIORITY_BULK):
+        """
+        Queue a (N, C, H, W) tensor of preprocessed images for encoding.
+
+        Returns:
+            Future resolving to the (N, D) output of model.encode_image
+        """
+        request = _Request(images, priority)
+        if len(images) == 0:
+            request.future.set_result(self.model.encode_image(images))
+            return request.future
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Inference scheduler is closed")
+            self._ensure_started()
+            heapq.heappush(self._queue, (priority, next(self._sequence), request))
+            self._queued_rows += len(images)
+            self._cond.notify()
+        return request.future
+
+    def _next_batch(self):
+        """Wait for work, then take up to max_batch_size rows in priority order."""
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if self._closed and not self._queue:
+                return None
+
+            # Give concurrent jobs a moment to add to a batch that is not full yet
+            deadline = time.time() + self.max_wait_ms / 1000
+            while self._queued_rows < self.max_batch_size and not self._closed:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                self._cond.wait(timeout)
+
+            batch = []
+            rows = 0
+            while self._queue and rows < self.max_batch_size:
+                _, _, request = self._queue[0]
+                take = min(request.remaining, self.max_batch_size - rows)
+                batch.append((request, request.offset, take))
+                request.offset += take
+                rows += take
+                if request.remaining == 0:
+                    heapq.heappop(self._queue)
+            self._queued_rows -= rows
+            return batch
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            started = time.time()
+            try:
+                inputs = torch.cat([request.images[start:start + take] for request, start, take in batch])
+                with torch.no_grad():
+                    outputs = self.model.encode_image(inputs)
+            except Exception as e:
+                for request, _, _ in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                continue
+
+            position = 0
+            for request, start, take in batch:
+                request.parts.append(outputs[position:position + take])
+                position += take
+                if start + take == len(request.images) and not request.future.done():
+                    request.future.set_result(torch.cat(request.parts))
+            self._record(batch, len(inputs), started)
+
+    def _record(self, batch, size, started):
+        bucket = str(1 << (size.bit_length() - 1))
+        with self._cond:
+            self._batches += 1
+            self._rows += size
+            self._batch_sizes[bucket] = self._batch_sizes.get(bucket, 0) + 1
+            for request, start, take in batch:
+                self._rows_by_priority[request.priority] = self._rows_by_priority.get(request.priority, 0) + take
+                if start == 0:
+                    # First slice of this request: record how long it queued
+                    wait_ms = (started - request.submitted_at) * 1000
+                    self._waits += 1
+                    self._wait_ms_total += wait_ms
+                    self._max_wait_ms_seen = max(self._max_wait_ms_seen, wait_ms)
+
+    def stats(self):
+        """
+        Return queue depth, batch counters and a histogram of batch sizes.
+
+        Histogram keys are power-of-two lower bounds ("8" counts batches of 8-15 images).
+        """
+        with self._cond:
+            return {
+                "queued_requests": len(self._queue),
+                "queued_images": self._queued_rows,
+                "batches": self._batches,
+                "images": self._rows,
+                "avg_batch_size": round(self._rows / self._batches, 2) if self._batches else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items(), key=lambda item: int(item[0]))),
+                "images_by_priority": dict(self._rows_by_priority),
+                "avg_queue_wait_ms": round(self._wait_ms_total / self._waits, 2) if self._waits else 0.0,
+                "max_queue_wait_ms": round(self._max_wait_ms_seen, 2),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+            }
+
+    def close(self, timeout=10):
+        """Finish queued work and stop the scheduler thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
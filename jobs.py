@@ -0,0 +1,378 @@
+"""
+Search jobs: per-request progress, cancellation and results.
+
+Each search runs as a job with its own id and progress state, so concurrent
+searches no longer overwrite each other's progress. Jobs run on a bounded
+background worker pool so requests return immediately.
+
+With a state directory, every job's state is also written to a small JSON
+file keyed by its id, so any worker process of the server can report a
+job's progress and results or cancel it, not only the one running it.
+"""
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from atomic_file import atomic_open
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once it has been cancelled."""
+
+
+class SearchJob:
+    """
+    State of a single search.
+
+    Status goes pending → running → done / failed / cancelled.
+    """
+
+    def __init__(self, job_id, path=None):
+        self.id = job_id
+        # State file shared with the other worker processes (None to keep the job in memory only)
+        self.path = path
+        self.created_at = time.time()
+        self.finished_at = None
+        self.status = "pending"
+        self.progress = {"count": 0, "done": False, "message": ""}
+        self.result = None
+        self.error = None
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+        # Bumped on every state change; progress streams wait on _changed for it
+        self._version = 0
+        self._changed = threading.Condition(self._lock)
+        if path:
+            self._persist()
+
+    @property
+    def cancelled(self):
+        # Another worker process cancels the job by leaving a marker file
+        if not self._cancel_event.is_set() and self.path and os.path.exists(self.path + ".cancel"):
+            self._cancel_event.set()
+        return self._cancel_event.is_set()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    def update_progress(self, data):
+        """
+        Merge a progress update into the job state.
+
+        Used as the scrapers' progress_callback, so it also raises
+        JobCancelled to stop work once the job has been cancelled.
+        """
+        with self._lock:
+            if not self.finished:
+                changed = any(self.progress.get(k) != v for k, v in data.items())
+                self.progress.update(data)
+                # Scrapers mark their own phase as done; the job is only done when it finishes
+                self.progress["done"] = False
+                if changed:
+                    self._notify()
+        self.raise_if_cancelled()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled(f"Job {self.id} was cancelled")
+
+    def start(self):
+        with self._lock:
+            self.status = "running"
+            self._notify()
+
+    def finish(self, result, message):
+        with self._lock:
+            self.result = result
+            self._set_finished("done", message)
+
+    def fail(self, error):
+        with self._lock:
+            self.error = str(error)
+            self._set_finished("failed", f"Error: {error}")
+
+    def cancel(self):
+        """Request cancellation; the job stops at its next progress update."""
+        self._cancel_event.set()
+        with self._lock:
+            if self.status == "pending":
+                self._set_finished("cancelled", "Cancelled")
+
+    def mark_cancelled(self):
+        with self._lock:
+            self._set_finished("cancelled", "Cancelled")
+
+    def _set_finished(self, status, message):
+        self.status = status
+        self.finished_at = time.time()
+        self.progress["done"] = True
+        self.progress["message"] = message
+        # Best-so-far matches are superseded by the result (or void on failure)
+        self.progress.pop("partial_results", None)
+        self._notify()
+
+    def _notify(self):
+        """Wake progress streams and publish the state; the caller holds the lock."""
+        self._version += 1
+        self._changed.notify_all()
+        if self.path:
+            self._persist()
+
+    def _persist(self):
+        """Atomically write the job state for the other worker processes; the caller holds the lock."""
+        state = {**self._state(), "version": self._version, "pid": os.getpid()}
+        try:
+            with atomic_open(self.path) as f:
+                json.dump(state, f)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"⚠️ Could not write state of job {self.id}: {e}")
+
+    def wait_for_update(self, last_version, timeout):
+        """
+        Block until the job state changes past `last_version`.
+
+        Each client only tracks the last version it sent, so updates that
+        happen while it is busy are coalesced into the latest state instead
+        of queueing up.
+
+        Returns:
+            Tuple (version, progress) or None if nothing changed within `timeout`
+        """
+        with self._changed:
+            if not self._changed.wait_for(lambda: self._version > last_version, timeout=timeout):
+                return None
+            return self._version, dict(self.progress)
+
+    def snapshot(self):
+        """Return a JSON-serializable copy of the job state."""
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "progress": dict(self.progress),
+        }
+        if self.error is not None:
+            data["error"] = self.error
+        if self.result is not None:
+            data["result"] = self.result
+        return data
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_state(path):
+    """Return the state written by a job's owner, or None if it is missing or unreadable."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state["status"] in ("pending", "running") and not _process_alive(state.get("pid", 0)):
+        # The owning worker exited (crash, restart) before finishing the job
+        state.update(status="failed", error="Worker process exited")
+        state["progress"].update(done=True, message="Error: Worker process exited")
+        state["version"] += 1
+    return state
+
+
+class StoredJob:
+    """
+    A job running in another worker process, read from its state file.
+
+    Provides the read side of SearchJob (snapshot, wait_for_update) plus
+    cancel, which leaves a marker the owning process picks up at the job's
+    next progress update.
+    """
+
+    # Seconds between state file reads while waiting for an update
+    poll_interval = 0.2
+
+    def __init__(self, job_id, path, state):
+        self.id = job_id
+        self.path = path
+        self._state = state
+
+    def _refresh(self):
+        # Keep the last state if the file was pruned in the meantime
+        self._state = _read_state(self.path) or self._state
+        return self._state
+
+    def cancel(self):
+        with open(self.path + ".cancel", "a"):
+            pass
+
+    def wait_for_update(self, last_version, timeout):
+        """Poll the state file until its version passes `last_version`; see SearchJob."""
+        deadline = time.time() + timeout
+        while True:
+            state = self._refresh()
+            if state["version"] > last_version:
+                return state["version"], dict(state["progress"])
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            time.sleep(min(self.poll_interval, remaining))
+
+    def snapshot(self):
+        state = self._refresh()
+        return {k: v for k, v in state.items() if k not in ("version", "pid")}
+
+
+class JobRegistry:
+    """
+    Thread-safe registry of search jobs.
+
+    Finished jobs are kept for `ttl` seconds so their results can still be
+    fetched, then dropped. With a `root` directory, jobs created by other
+    processes sharing it are found too (see StoredJob).
+    """
+
+    def __init__(self, ttl=600, root=None):
+        self.ttl = ttl
+        self.root = root
+        self._jobs = {}
+        self._lock = threading.Lock()
+        if root:
+            os.makedirs(root, exist_ok=True)
+
+    def _path(self, job_id):
+        return os.path.join(self.root, job_id + ".json") if self.root else None
+
+    def create(self):
+        """Create and register a new job with a random id."""
+        with self._lock:
+            self._prune()
+            job_id = uuid.uuid4().hex
+            job = SearchJob(job_id, path=self._path(job_id))
+            self._jobs[job.id] = job
+            return job
+
+    def get(self, job_id):
+        """Return a job of this process, a StoredJob for one of another process, or None."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        # Ids are checked before use as file names
+        if job is None and self.root and re.fullmatch(r"[0-9a-f]{32}", job_id):
+            state = _read_state(self._path(job_id))
+            if state is not None:
+                job = StoredJob(job_id, self._path(job_id), state)
+        return job
+
+    def _prune(self):
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and now - job.finished_at > self.ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+        if self.root:
+            self._prune_files(now)
+
+    def _prune_files(self, now):
+        """Delete state files of jobs, from any process, that finished more than `ttl` ago."""
+        for name in os.listdir(self.root):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                if now - os.stat(path).st_mtime <= self.ttl:
+                    continue
+            except OSError:
+                continue
+            state = _read_state(path)
+            if state is not None and state["status"] in ("pending", "running"):
+                continue
+            for stale in (path, path + ".cancel"):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+
+
+class QueueFull(Exception):
+    """Raised when the worker pool cannot accept more jobs."""
+
+
+class JobWorkerPool:
+    """
+    Bounded pool of background workers running search jobs.
+
+    At most `max_workers` jobs run at once and at most `max_queue` more wait
+    for a worker; submissions beyond that are rejected with QueueFull instead
+    of piling up threads.
+    """
+
+    def __init__(self, max_workers=2, max_queue=8):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="search-worker")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._running = 0
+        self._queued = 0
+        self._rejected = 0
+
+    def submit(self, job, fn, *args):
+        """
+        Queue `fn(job, *args)` to run on a worker.
+
+        `fn` returns the job result dictionary; its optional "message" is
+        used as the final progress message.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise QueueFull("Too many searches in progress, please retry shortly")
+        with self._lock:
+            self._queued += 1
+        self._executor.submit(self._run, job, fn, args)
+
+    def _run(self, job, fn, args):
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        try:
+            if job.cancelled:
+                job.mark_cancelled()
+                return
+            job.start()
+            result = fn(job, *args)
+            job.finish(result, result.get("message", "Complete!"))
+        except JobCancelled:
+            print(f"🛑 Search job {job.id} cancelled")
+            job.mark_cancelled()
+        except Exception as e:
+            print(f"❌ Error in search job {job.id}: {e}")
+            job.fail(e)
+        finally:
+            with self._lock:
+                self._running -= 1
+            self._slots.release()
+
+    def stats(self):
+        """Return running/queued counts and capacity."""
+        with self._lock:
+            return {
+                "running": self._running,
+                "queued": self._queued,
+                "rejected": self._rejected,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+            }
@@ -0,0 +1,189 @@
+"""
+Build product lists from the JSON/XHR responses a listing page makes while
+scrolling, instead of parsing the rendered DOM.
+
+Extractors decide which responses are product-listing payloads and how to
+turn them into raw cards (href, img_src, title), the same shape the DOM
+extraction in scraper.py produces, so both go through the same dedupe.
+"""
+import json
+import re
+from urllib.parse import urljoin
+
+NAME_KEYS = ("name", "title", "productName", "product_name", "displayName")
+LINK_KEYS = ("url", "link", "href", "productUrl", "product_url", "pdpUrl", "handle", "slug")
+IMAGE_KEYS = ("image", "imageUrl", "image_url", "img", "images", "thumbnail", "featured_image", "media")
+IMAGE_URL_KEYS = ("url", "src", "href", "link")
+
+
+def _first(item, keys):
+    for key in keys:
+        value = item.get(key)
+        if value:
+            return value
+    return None
+
+
+def _image_url(value):
+    """Pull an image URL out of a string, {url/src} object or list of those."""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        return _image_url(_first(value, IMAGE_URL_KEYS))
+    if isinstance(value, list):
+        for entry in value:
+            url = _image_url(entry)
+            if url:
+                return url
+    return None
+
+
+class JsonProductExtractor:
+    """
+    Extract products from JSON payloads whose URL matches `url_pattern`.
+
+    Args:
+        url_pattern: Regex matched against the response URL; it should only match
+                     the listing's own endpoint, since recommendation, recently
+                     viewed and cart responses contain product lists too
+        items_path: Keys leading to the product list (e.g. ["data", "products"]);
+                    when None, the largest list of product-like objects is used
+        link_template: Format string for the link built from the item fields
+                       (e.g. "/products/{handle}"); defaults to the first link key
+        name_keys, link_keys, image_keys: Candidate field names, in priority order
+    """
+
+    def __init__(self, url_pattern, items_path=None, link_template=None,
+                 name_keys=NAME_KEYS, link_keys=LINK_KEYS, image_keys=IMAGE_KEYS):
+        self.url_pattern = re.compile(url_pattern)
+        self.items_path = items_path
+        self.link_template = link_template
+        self.name_keys = name_keys
+        self.link_keys = link_keys
+        self.image_keys = image_keys
+
+    def matches(self, url):
+        return bool(self.url_pattern.search(url))
+
+    def _is_product(self, item):
+        return (
+            isinstance(item, dict)
+            and _first(item, self.name_keys) is not None
+            and _first(item, self.image_keys) is not None
+        )
+
+    def _find_items(self, payload):
+        if self.items_path is not None:
+            for key in self.items_path:
+                if isinstance(payload, dict):
+                    payload = payload.get(key)
+                elif isinstance(payload, list) and isinstance(key, int) and key < len(payload):
+                    payload = payload[key]
+                else:
+                    return []
+            return payload if isinstance(payload, list) else []
+
+        # Auto-discover: the largest list whose entries look like products
+        best = []
+        stack = [payload]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                stack.extend(node.values())
+            elif isinstance(node, list):
+                products = [item for item in node if self._is_product(item)]
+                if len(products) > len(best):
+                    best = products
+                stack.extend(item for item in node if isinstance(item, (dict, list)))
+        return best
+
+    def extract(self, payload, response_url):
+        """
+        Returns:
+            List of raw cards with href, img_src and title
+        """
+        cards = []
+        for item in self._find_items(payload):
+            if not self._is_product(item):
+                continue
+            if self.link_template:
+                try:
+                    href = self.link_template.format(**item)
+                except (KeyError, IndexError):
+                    href = None
+            else:
+                href = _first(item, self.link_keys)
+            img_src = _image_url(_first(item, self.image_keys))
+            if not isinstance(href, str) or not img_src:
+                continue
+            if img_src.startswith("//"):
+                img_src = "https:" + img_src
+            cards.append({
+                "href": href,
+                "img_src": urljoin(response_url, img_src),
+                "title": str(_first(item, self.name_keys)),
+            })
+        return cards
+
+
+def extractors_from_config(configs):
+    """Build extractors from a site profile's list of JsonProductExtractor arguments."""
+    return [JsonProductExtractor(**config) for config in configs]
+
+
+class NetworkCapture:
+    """
+    Record JSON XHR/fetch responses of a page and extract products from them.
+
+    Responses are only collected while the page runs; their bodies are read
+    and parsed afterwards in `extract_cards`.
+
+    Raises:
+        ValueError: If no extractors are given; any JSON response could
+                    otherwise be taken for the product listing
+    """
+
+    def __init__(self, extractors):
+        if not extractors:
+            raise ValueError("Network capture needs at least one extractor with a listing url_pattern")
+        self.extractors = extractors
+        self.responses = []
+
+    def attach(self, page):
+        page.on("response", self._on_response)
+
+    def _on_response(self, response):
+        try:
+            if response.request.resource_type not in ("xhr", "fetch"):
+                return
+            if "json" not in response.headers.get("content-type", ""):
+                return
+        except Exception:
+            return
+        if any(extractor.matches(response.url) for extractor in self.extractors):
+            self.responses.append(response)
+
+    def extract_cards(self):
+        """
+        Parse the captured payloads into raw product cards.
+
+        Returns:
+            Tuple (cards, payloads_used)
+        """
+        cards = []
+        payloads_used = 0
+        for response in self.responses:
+            try:
+                payload = json.loads(response.body())
+            except Exception:
+                continue
+            for extractor in self.extractors:
+                if not extractor.matches(response.url):
+                    continue
+                extracted = extractor.extract(payload, response.url)
+                if extracted:
+                    cards.extend(extracted)
+                    payloads_used += 1
+                    break
+        return cards, payloads_used
+
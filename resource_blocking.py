@@ -0,0 +1,127 @@
+"""
+Route-based request blocking and per-site page settings for Playwright scrapes.
+
+We only need product links and image URLs from attributes (images are
+downloaded separately for matching), so by default images, media, fonts and
+known analytics/ads domains are aborted before they hit the network. Sites
+can allowlist domains they need and opt into headless mode when their bot
+protection allows it.
+"""
+import threading
+from urllib.parse import urlparse
+
+DEFAULT_BLOCKED_RESOURCE_TYPES = ("image", "media", "font")
+
+DEFAULT_BLOCKED_DOMAINS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "googleadservices.com",
+    "doubleclick.net",
+    "facebook.net",
+    "connect.facebook.net",
+    "hotjar.com",
+    "segment.io",
+    "segment.com",
+    "optimizely.com",
+    "criteo.com",
+    "criteo.net",
+    "tiktok.com",
+    "bat.bing.com",
+    "clarity.ms",
+    "newrelic.com",
+    "nr-data.net",
+    "quantummetric.com",
+    "pinterest.com",
+    "snapchat.com",
+)
+
+# Per-site overrides, matched on the listing URL's host (or a parent domain):
+# - headless: whether the site tolerates a headless browser
+# - allow_domains: domains never blocked for this site
+# - block_types / block_domains: replace the defaults
+# - card_selector: product card counted while scrolling (first matching PRODUCT_SELECTORS
+#   entry of scraper.py when omitted)
+# - total_selector: element holding the listing's result count (e.g. "1,410 Products"),
+#   used by the scroll engine to stop once every product is loaded
+# - capture_mode: "network" to build products from the listing's product JSON
+#   responses instead of the DOM (falls back to the DOM when none is captured)
+# - extractors: JsonProductExtractor arguments for those responses, required for
+#   network capture, e.g. [{"url_pattern": r"/api/search", "items_path": ["data", "products"]}]
+#   (see network_capture.py); without them the DOM is used
+SITE_PROFILES = {
+    # Tommy Hilfiger blocks headless browsers. Its listing endpoint is not mapped to
+    # an extractor yet, so products come from the DOM
+    "tommy.com": {"headless": False, "card_selector": "a.pdpurl"},
+    "scrapingcourse.com": {"headless": True},
+}
+
+
+def _host_matches(host, domain):
+    return host == domain or host.endswith("." + domain)
+
+
+def site_profile(url):
+    """Return the profile for a listing URL, or an empty dict."""
+    host = urlparse(url if "://" in url else "https://" + url).netloc.lower()
+    for domain, profile in SITE_PROFILES.items():
+        if _host_matches(host, domain):
+            return profile
+    return {}
+
+
+class ResourceBlocker:
+    """
+    Abort requests by resource type or domain via page/context routing.
+
+    Args:
+        block_types: Playwright resource types to abort (e.g. "image", "font")
+        block_domains: Domains (and their subdomains) to abort
+        allow_domains: Domains that are never blocked, even for blocked types
+    """
+
+    def __init__(self, block_types=DEFAULT_BLOCKED_RESOURCE_TYPES, block_domains=DEFAULT_BLOCKED_DOMAINS,
+                 allow_domains=()):
+        self.block_types = set(block_types)
+        self.block_domains = tuple(block_domains)
+        self.allow_domains = tuple(allow_domains)
+        self._lock = threading.Lock()
+        self.blocked = {}
+        self.allowed = 0
+
+    @classmethod
+    def for_site(cls, url):
+        """Build a blocker with the site's profile applied on top of the defaults."""
+        profile = site_profile(url)
+        return cls(
+            block_types=profile.get("block_types", DEFAULT_BLOCKED_RESOURCE_TYPES),
+            block_domains=profile.get("block_domains", DEFAULT_BLOCKED_DOMAINS),
+            allow_domains=profile.get("allow_domains", ()),
+        )
+
+    def should_block(self, url, resource_type):
+        host = urlparse(url).netloc.lower()
+        if any(_host_matches(host, domain) for domain in self.allow_domains):
+            return False
+        if resource_type in self.block_types:
+            return True
+        return any(_host_matches(host, domain) for domain in self.block_domains)
+
+    def _handle_route(self, route):
+        request = route.request
+        if self.should_block(request.url, request.resource_type):
+            with self._lock:
+                self.blocked[request.resource_type] = self.blocked.get(request.resource_type, 0) + 1
+            route.abort()
+        else:
+            with self._lock:
+                self.allowed += 1
+            route.continue_()
+
+    def install(self, target):
+        """Start blocking on a Playwright page or browser context."""
+        target.route("**/*", self._handle_route)
+
+    def stats(self):
+        """Return blocked request counts by resource type and the allowed count."""
+        with self._lock:
+            return {"blocked": dict(self.blocked), "allowed": self.allowed}
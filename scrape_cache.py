@@ -0,0 +1,314 @@
+"""
+Shared cache of scraper results.
+
+Results are keyed by the normalized store/collection (see catalog_key) and
+served in three states:
+
+- fresh (younger than `ttl`): returned as is
+- stale (younger than `ttl + stale_ttl`): returned immediately while one
+  background refresh re-scrapes the store
+- expired / missing: scraped, with concurrent identical requests coalesced
+  into a single scrape whose progress is forwarded to every waiter; a
+  waiter whose leader runs longer than `wait_timeout` scrapes on its own
+
+Entries live in a size-bounded in-memory LRU and, optionally, in a
+size-bounded directory of JSON files that survives restarts.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from atomic_file import atomic_open
+
+
+class MemoryBackend:
+    """In-memory LRU of cache entries, bounded by their serialized size."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key, entry):
+        self.delete(key)
+        self._entries[key] = entry
+        self.size += entry["size"]
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= evicted["size"]
+
+    def delete(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry["size"]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskBackend:
+    """
+    One JSON file per entry, bounded by total size.
+
+    Reads touch the file's mtime, so eviction removes the least recently
+    used files first.
+    """
+
+    def __init__(self, root="scrape_cache", max_bytes=512 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, hashlib.sha1(key.encode("utf-8")).hexdigest()[:16] + ".json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get("key") == key else None
+
+    def set(self, key, entry):
+        with atomic_open(self._path(key)) as f:
+            json.dump({**entry, "key": key}, f)
+        self._evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        files = []
+        for name in os.listdir(self.root):
+            if not name.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.root, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files)[:-1]:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.root, name))
+                total -= size
+            except OSError:
+                pass
+
+
+class _InFlight:
+    """A running scrape and the progress callbacks of everyone waiting for it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.callbacks = []
+        self.result = None
+        self.error = None
+
+
+class ScrapeCache:
+    """
+    TTL cache with stale-while-revalidate and request coalescing for scrapes.
+
+    Args:
+        ttl: Seconds a result is served without refreshing
+        stale_ttl: Further seconds a result is still served while refreshing in the background
+        max_bytes: Size bound of the in-memory LRU
+        disk_dir: Directory of the on-disk backend (None to keep results in memory only)
+        disk_max_bytes: Size bound of the on-disk backend
+        wait_timeout: Seconds a coalesced request waits for the running scrape
+                      before scraping on its own
+    """
+
+    def __init__(self, ttl=600, stale_ttl=3600, max_bytes=64 * 1024 * 1024, disk_dir=None,
+                 disk_max_bytes=512 * 1024 * 1024, wait_timeout=600):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.wait_timeout = wait_timeout
+        self.memory = MemoryBackend(max_bytes)
+        self.disk = DiskBackend(disk_dir, disk_max_bytes) if disk_dir else None
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._counts = {"hit": 0, "stale": 0, "miss": 0, "coalesced": 0, "refreshes": 0, "wait_timeouts": 0}
+
+    def _get_entry(self, key):
+        """Look the key up in memory, then on disk; the disk read happens outside the lock."""
+        with self._lock:
+            entry = self.memory.get(key)
+        if entry is not None or self.disk is None:
+            return entry
+        entry = self.disk.get(key)
+        if entry is not None:
+            with self._lock:
+                # Another thread may have stored a newer result during the read
+                current = self.memory.get(key)
+                if current is not None and current["stored_at"] >= entry["stored_at"]:
+                    return current
+                self.memory.set(key, entry)
+        return entry
+
+    def _store(self, key, result):
+        # Failed scrapes come back without products; never cache those
+        if not result.get("products"):
+            return
+        entry = {"stored_at": time.time(), "result": result, "size": len(json.dumps(result))}
+        with self._lock:
+            self.memory.set(key, entry)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, entry)
+            except OSError as e:
+                print(f"⚠️ Could not write scrape cache entry for {key}: {e}")
+
+    def get_or_scrape(self, key, scrape, progress_callback=None, cancel_check=None):
+        """
+        Return the cached result for `key`, scraping it if needed.
+
+        Args:
+            key: Normalized store/collection key
+            scrape: Callable (progress_callback) -> scraper result dictionary
+            progress_callback: Optional callback for progress updates of a scrape
+            cancel_check: Optional callable that raises once the caller is cancelled;
+                          polled while waiting for another request's scrape
+
+        Returns:
+            Copy of the scraper result with a "cache" entry holding the
+            status (hit, stale, miss or coalesced) and the result's age
+        """
+        entry = self._get_entry(key)
+        with self._lock:
+            age = time.time() - entry["stored_at"] if entry is not None else None
+
+            if entry is not None and age < self.ttl:
+                status = "hit"
+            elif entry is not None and age < self.ttl + self.stale_ttl:
+                status = "stale"
+                if key not in self._in_flight:
+                    self._counts["refreshes"] += 1
+                    self._in_flight[key] = _InFlight()
+                    threading.Thread(
+                        target=self._run_scrape, args=(key, scrape, self._in_flight[key]),
+                        name="scrape-refresh", daemon=True
+                    ).start()
+            else:
+                flight = self._in_flight.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._in_flight[key] = _InFlight()
+                    status = "miss"
+                else:
+                    status = "coalesced"
+                if progress_callback:
+                    flight.callbacks.append(progress_callback)
+            self._counts[status] += 1
+
+        if status in ("hit", "stale"):
+            print(f"💾 Scrape cache {status} for {key} ({age:.0f}s old)")
+            return self._with_cache_info(entry["result"], status, age)
+
+        if leader:
+            self._run_scrape(key, scrape, flight)
+        else:
+            print(f"⏳ Waiting for the running scrape of {key}")
+            if not self._wait(flight, progress_callback, cancel_check):
+                return self._scrape_after_timeout(key, scrape, flight, progress_callback)
+
+        if flight.error is not None:
+            raise flight.error
+        return self._with_cache_info(flight.result, status, 0.0)
+
+    def _run_scrape(self, key, scrape, flight):
+        def forward_progress(data):
+            # Deliver progress to every waiter; a waiter whose callback raises
+            # (e.g. its job was cancelled) stops receiving updates, and the
+            # scrape is only abandoned once nobody is waiting for it
+            error = None
+            for callback in list(flight.callbacks):
+                try:
+                    callback(data)
+                except Exception as e:
+                    if callback in flight.callbacks:
+                        flight.callbacks.remove(callback)
+                    error = e
+            if error is not None and not flight.callbacks:
+                raise error
+
+        try:
+            flight.result = scrape(forward_progress)
+            self._store(key, flight.result)
+        except Exception as e:
+            print(f"❌ Scrape of {key} failed: {e}")
+            flight.error = e
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            flight.done.set()
+
+    def _wait(self, flight, progress_callback, cancel_check, poll_seconds=1.0):
+        """
+        Wait for a leader's scrape, checking for cancellation between short waits.
+
+        Returns:
+            False if the scrape is still running after `wait_timeout`
+        """
+        deadline = time.time() + self.wait_timeout
+        while not flight.done.wait(min(poll_seconds, max(0.0, deadline - time.time()))):
+            if cancel_check is not None:
+                try:
+                    cancel_check()
+                except Exception:
+                    with self._lock:
+                        if progress_callback in flight.callbacks:
+                            flight.callbacks.remove(progress_callback)
+                    raise
+            if time.time() >= deadline:
+                return False
+        return True
+
+    def _scrape_after_timeout(self, key, scrape, flight, progress_callback):
+        """Give up on a hung leader and scrape directly; the result still refreshes the cache."""
+        print(f"⚠️ Scrape of {key} still running after {self.wait_timeout}s, scraping again")
+        with self._lock:
+            self._counts["wait_timeouts"] += 1
+            if progress_callback in flight.callbacks:
+                flight.callbacks.remove(progress_callback)
+        result = scrape(progress_callback or (lambda data: None))
+        self._store(key, result)
+        return self._with_cache_info(result, "miss", 0.0)
+
+    @staticmethod
+    def _with_cache_info(result, status, age):
+        return {**result, "cache": {"status": status, "age": round(age, 1)}}
+
+    def invalidate(self, key):
+        with self._lock:
+            self.memory.delete(key)
+        if self.disk is not None:
+            self.disk.delete(key)
+
+    def stats(self):
+        """Return hit/stale/miss/coalesced counters and the in-memory size."""
+        with self._lock:
+            return {
+                **self._counts,
+                "entries": len(self.memory),
+                "bytes": self.memory.size,
+                "in_flight": len(self._in_flight),
+            }
@@ -1,210 +1,90 @@
-from playwright.sync_api import sync_playwright
+import os
+import threading
 import time
+from urllib.parse import urlparse
+from browser_pool import BrowserPool, DEFAULT_LAUNCH_OPTIONS
+from network_capture import NetworkCapture, extractors_from_config
+from resource_blocking import ResourceBlocker, site_profile
+from scroll_engine import SCROLL_MODES
+
+_browser_pools = {}
+_browser_pool_lock = threading.Lock()
+
+
+def get_browser_pool(headless=False):
+    """Shared pool of warm browsers used by the Playwright scrapers, one per headless mode."""
+    with _browser_pool_lock:
+        if headless not in _browser_pools:
+            _browser_pools[headless] = BrowserPool(
+                size=int(os.environ.get("BROWSER_POOL_SIZE", 2)),
+                max_uses=int(os.environ.get("BROWSER_MAX_USES", 50)),
+                launch_options={**DEFAULT_LAUNCH_OPTIONS, "headless": headless}
+            )
+        return _browser_pools[headless]
+
+
+def browser_pool_stats():
+    """Utilization of every browser pool started so far."""
+    with _browser_pool_lock:
+        pools = dict(_browser_pools)
+    return {("headless" if headless else "headed"): pool.stats() for headless, pool in pools.items()}
+
 
-def scrape_us_tommy(url="https://usa.tommy.com/en/women", progress_callback=None):
+def scrape_us_tommy(url="https://usa.tommy.com/en/women", progress_callback=None, scroll_mode="adaptive",
+                    extraction_mode="bulk", capture_mode=None, extractors=None, lightweight=True,
+                    headless=None):
     """
     Generic product scraper for e-commerce sites.
 
+    scroll_mode selects the infinite-scroll engine: "adaptive" (waits on card
+    count growth) or "fixed" (original loop with fixed sleeps).
+    extraction_mode selects how cards are read: "bulk" (one in-page script for
+    all cards) or "handles" (per-card element handles).
+    capture_mode="network" builds products from the page's product JSON
+    responses (parsed by `extractors`, see network_capture.py), falling back
+    to the DOM if none is captured or no extractors are configured.
+    lightweight blocks images, media, fonts and analytics domains (see
+    resource_blocking.py; always on for network capture). capture_mode,
+    extractors and headless default to the site's profile, then to DOM
+    capture and a headed browser.
+
     Returns a dictionary with:
     - products: list of product dictionaries
     - total_cards: total number of product cards found (before deduplication)
     - unique_products: number of unique products (after deduplication)
+    - scroll_stats: cards loaded, scrolls and time-to-all-cards of the scroll engine
+    - blocked_requests: requests aborted by the resource blocker, by type
+    - complete: False when the listing may be only partly loaded (scroll time
+      limit, scrolling stopped at a total guessed from the page text, or no
+      product card was ever counted), so catalog sync does not drop the
+      products that were not seen
 
     Note: Some websites have bot protection that may prevent scraping.
     The Tommy Hilfiger site currently blocks automated access.
     For testing, try alternative sites like:
     - https://www.scrapingcourse.com/ecommerce/ (demo site)
     """
-    products = []
-    seen_names = set()
-    total_cards = 0  # Track total cards found
+    profile = site_profile(url)
+    if headless is None:
+        headless = profile.get("headless", False)
+    if capture_mode is None:
+        capture_mode = profile.get("capture_mode", "dom")
+    if extractors is None and profile.get("extractors"):
+        extractors = extractors_from_config(profile["extractors"])
+    if capture_mode == "network" and not extractors:
+        # Without a listing url_pattern, cart or recommendation payloads would pass for the listing
+        print("⚠️ Network capture needs extractors for this site, using DOM extraction")
+        capture_mode = "dom"
+    blocker = ResourceBlocker.for_site(url) if lightweight or capture_mode == "network" else None
 
     try:
-        with sync_playwright() as p:
-            # Launch with non-headless mode to avoid bot detection
-            # Many sites block headless browsers, so we use headed mode
-            browser = p.chromium.launch(
-                headless=False,  # Set to False to bypass bot detection
-                args=[
-                    '--disable-blink-features=AutomationControlled',
-                    '--disable-dev-shm-usage',
-                    '--no-sandbox'
-                ]
-            )
-            # Create context with realistic browser settings to avoid bot detection
-            context = browser.new_context(
-                ignore_https_errors=True,
-                user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                viewport={'width': 1920, 'height': 1080},
-                locale='en-US',
-                timezone_id='America/New_York',
-                java_script_enabled=True
+        products, total_cards, scroll_stats = get_browser_pool(headless).run(
+            lambda page: _scrape_page(
+                page, url, progress_callback, scroll_mode=scroll_mode, extraction_mode=extraction_mode,
+                capture_mode=capture_mode, extractors=extractors, blocker=blocker,
+                card_selector=profile.get("card_selector"), total_selector=profile.get("total_selector")
             )
-
-            # Add stealth scripts
-            context.add_init_script("""
-                Object.defineProperty(navigator, 'webdriver', {
-                    get: () => undefined
-                });
-            """)
-
-            page = context.new_page()
-
-            print(f"🚀 Navigating to {url} ...")
-            try:
-                page.goto(url, timeout=120000, wait_until="domcontentloaded")
-            except Exception as e:
-                print(f"❌ Failed to load page: {e}")
-                if progress_callback:
-                    progress_callback({"count": 0, "done": True, "message": f"Failed to load page: {str(e)}"})
-                return products
-
-            if progress_callback:
-                progress_callback({"count": 0, "done": False, "message": "Page loaded, scrolling..."})
-
-            # Accept cookies if banner appears
-            try:
-                page.click("button:has-text('Accept')", timeout=5000)
-                print("✅ Accepted cookies")
-            except:
-                pass
-
-            # Use infinite scroll to load all products
-            # Tommy Hilfiger uses lazy loading - products appear as you scroll
-            print("📜 Using infinite scroll to load all products...")
-            print("   This will take several minutes for 1,410 products...")
-
-            previous_product_count = 0
-            scroll_attempts = 0
-            max_scrolls = 100  # Increased for 1410 products
-            no_new_products_count = 0
-
-            while scroll_attempts < max_scrolls:
-                # Scroll to bottom in multiple steps (more realistic)
-                for _ in range(3):
-                    page.evaluate("window.scrollBy(0, 500)")
-                    time.sleep(0.5)
-
-                # Wait for lazy loading
-                time.sleep(2)
-
-                # Check current product count
-                current_product_count = len(page.query_selector_all("a.pdpurl"))
-
-                # Progress update
-                if current_product_count != previous_product_count:
-                    print(f"  Scroll #{scroll_attempts + 1}: {current_product_count} product cards loaded")
-                    no_new_products_count = 0
-
-                    if progress_callback and current_product_count % 50 == 0:
-                        progress_callback({
-                            "count": current_product_count,
-                            "done": False,
-                            "message": f"Loading products... ({current_product_count} cards loaded)"
-                        })
-                else:
-                    no_new_products_count += 1
-
-                # Stop if no new products for 10 consecutive scrolls
-                if no_new_products_count >= 10:
-                    print(f"✅ No new products after {no_new_products_count} scrolls")
-                    print(f"   Total product cards loaded: {current_product_count}")
-                    break
-
-                previous_product_count = current_product_count
-                scroll_attempts += 1
-
-                # Wait for network to settle occasionally
-                if scroll_attempts % 5 == 0:
-                    try:
-                        page.wait_for_load_state("networkidle", timeout=3000)
-                    except:
-                        pass
-
-            # Try multiple selectors for different site structures
-            product_selectors = [
-                "a.pdpurl",  # Tommy Hilfiger
-                "a.product-item",
-                "a[href*='/product/']",
-                ".product a[href*='/product']",
-                "article a",
-                ".product-card a",
-                "a.woocommerce-LoopProduct-link"  # WooCommerce sites
-            ]
-
-            product_cards = []
-            for selector in product_selectors:
-                product_cards = page.query_selector_all(selector)
-                if len(product_cards) > 0:
-                    total_cards = len(product_cards)  # Store total cards found
-                    print(f"🔎 Found {total_cards} product cards using selector: {selector}")
-                    break
-
-            if len(product_cards) == 0:
-                print("⚠️ No product cards found with any selector. The site may be blocking access or has a different structure.")
-                print("💡 Tip: Check the page manually and update the selectors in scraper.py")
-
-            if progress_callback and len(product_cards) > 0:
-                progress_callback({"count": len(product_cards), "done": False, "message": f"Found {len(product_cards)} products, extracting data..."})
-
-            for card in product_cards:
-                try:
-                    link = card.get_attribute("href")
-                    if not link:
-                        continue
-
-                    # Make link absolute if relative
-                    if link.startswith('/'):
-                        from urllib.parse import urlparse
-                        parsed_url = urlparse(url)
-                        link = f"{parsed_url.scheme}://{parsed_url.netloc}{link}"
-                    elif not link.startswith('http'):
-                        link = url.rstrip('/') + '/' + link.lstrip('/')
-
-                    # Find image - check the card and its children
-                    img = card.query_selector("img")
-                    if not img:
-                        # Look for image in parent or sibling elements
-                        parent = card.evaluate("el => el.parentElement")
-                        if parent:
-                            img = page.query_selector(f"xpath=//a[@href='{link}']/..//img")
-
-                    if not img:
-                        continue
-
-                    img_url = img.get_attribute("src") or img.get_attribute("data-src") or img.get_attribute("data-lazy")
-                    if not img_url:
-                        continue
-
-                    name = img.get_attribute("title") or img.get_attribute("alt") or card.text_content() or "Unnamed Product"
-                    name = name.strip()
-
-                    # Extract base product name (remove color variant after last comma)
-                    # E.g., "Varsity Tommy Logo Crewneck Sweatshirt, Misty Plum" -> "Varsity Tommy Logo Crewneck Sweatshirt"
-                    base_name = name
-                    if ',' in name:
-                        # Split on last comma to separate product name from color
-                        parts = name.rsplit(',', 1)
-                        base_name = parts[0].strip()
-
-                    # Only add if we haven't seen this base product name before
-                    if base_name and base_name not in seen_names:
-                        seen_names.add(base_name)
-                        products.append({
-                            "name": name[:100],  # Keep full name with color for display
-                            "base_name": base_name[:100],  # Store base name for reference
-                            "link": link,
-                            "img_url": img_url
-                        })
-
-                        # Update progress every 10 products
-                        if progress_callback and len(products) % 10 == 0:
-                            progress_callback({"count": len(products), "done": False, "message": f"Extracted {len(products)} products..."})
-                except Exception as e:
-                    print(f"⚠️ Error extracting product: {e}")
-                    continue
-
-            browser.close()
+        )
 
         print(f"✅ Final product count: {len(products)} unique products from {total_cards} cards")
 
@@ -215,10 +95,253 @@ def scrape_us_tommy(url="https://usa.tommy.com/en/women", progress_callback=None
         print(f"❌ Scraper error: {e}")
         if progress_callback:
             progress_callback({"count": 0, "done": True, "message": f"Scraper error: {str(e)}"})
+        products, total_cards, scroll_stats = [], 0, None
 
     # Return metadata along with products
     return {
         "products": products,
         "total_cards": total_cards,
-        "unique_products": len(products)
+        "unique_products": len(products),
+        "scroll_stats": scroll_stats,
+        "blocked_requests": blocker.stats() if blocker else None,
+        "complete": bool(scroll_stats and scroll_stats.get("complete"))
+    }
+
+
+def _scrape_page(page, url, progress_callback=None, scroll_mode="adaptive", extraction_mode="bulk",
+                 capture_mode="dom", extractors=None, blocker=None, card_selector=None, total_selector=None):
+    """
+    Load a listing page, scroll until all products are loaded and extract them.
+
+    The scroll engine counts `card_selector` cards; when None, the first
+    PRODUCT_SELECTORS entry present on the page is used.
+
+    Returns:
+        Tuple (products, total_cards, scroll_stats)
+    """
+    total_cards = 0  # Track total cards found
+    scroll_stats = None
+
+    if blocker is not None:
+        blocker.install(page)
+
+    capture = None
+    if capture_mode == "network":
+        # Listen for product JSON while scrolling
+        capture = NetworkCapture(extractors)
+        capture.attach(page)
+
+    print(f"🚀 Navigating to {url} ...")
+    try:
+        page.goto(url, timeout=120000, wait_until="domcontentloaded")
+    except Exception as e:
+        print(f"❌ Failed to load page: {e}")
+        if progress_callback:
+            progress_callback({"count": 0, "done": True, "message": f"Failed to load page: {str(e)}"})
+        return [], total_cards, scroll_stats
+
+    if progress_callback:
+        progress_callback({"count": 0, "done": False, "message": "Page loaded, scrolling..."})
+
+    # Accept cookies if banner appears
+    try:
+        page.click("button:has-text('Accept')", timeout=5000)
+        print("✅ Accepted cookies")
+    except:
+        pass
+
+    # Use infinite scroll to load all products
+    # Tommy Hilfiger uses lazy loading - products appear as you scroll
+    if card_selector is None:
+        card_selector = _detect_card_selector(page)
+    print(f"📜 Using {scroll_mode} infinite scroll to load all products (counting {card_selector})...")
+    scroll_stats = SCROLL_MODES[scroll_mode](
+        page, card_selector, progress_callback=progress_callback, total_selector=total_selector
+    )
+    scroll_stats["card_selector"] = card_selector
+    if scroll_stats["cards"] == 0:
+        # The counted selector never matched, so the stop says nothing about the listing
+        scroll_stats["complete"] = False
+
+    extract_start = time.time()
+    raw_cards = []
+    if capture is not None:
+        raw_cards, payloads_used = capture.extract_cards()
+        selector = f"network capture ({payloads_used} of {len(capture.responses)} JSON responses)"
+        if not raw_cards:
+            print("⚠️ No product JSON captured, falling back to DOM extraction")
+    if not raw_cards:
+        if extraction_mode == "bulk":
+            raw_cards, selector = _extract_cards_bulk(page)
+        else:
+            raw_cards, selector = _extract_cards_handles(page)
+    total_cards = len(raw_cards)  # Store total cards found
+    print(f"⏱️ {extraction_mode} extraction of {total_cards} cards took {time.time() - extract_start:.2f}s")
+
+    if total_cards == 0:
+        print("⚠️ No product cards found with any selector. The site may be blocking access or has a different structure.")
+        print("💡 Tip: Check the page manually and update the selectors in scraper.py")
+    else:
+        print(f"🔎 Found {total_cards} product cards using selector: {selector}")
+        if progress_callback:
+            progress_callback({"count": total_cards, "done": False, "message": f"Found {total_cards} products, extracting data..."})
+
+    products = _build_products(raw_cards, url, progress_callback)
+    return products, total_cards, scroll_stats
+
+
+# Try multiple selectors for different site structures
+PRODUCT_SELECTORS = [
+    "a.pdpurl",  # Tommy Hilfiger
+    "a.product-item",
+    "a[href*='/product/']",
+    ".product a[href*='/product']",
+    "article a",
+    ".product-card a",
+    "a.woocommerce-LoopProduct-link"  # WooCommerce sites
+]
+
+# Union of all product selectors; counted when no single one matches yet
+ANY_PRODUCT_SELECTOR = ", ".join(PRODUCT_SELECTORS)
+
+
+def _detect_card_selector(page, timeout=10000):
+    """
+    Return the first PRODUCT_SELECTORS entry present on the page.
+
+    Waits up to `timeout` ms for any product card to render; if none does,
+    the union of all selectors is returned so scrolling still sees cards
+    that only load later.
+    """
+    try:
+        page.wait_for_selector(ANY_PRODUCT_SELECTOR, timeout=timeout)
+    except Exception:
+        return ANY_PRODUCT_SELECTOR
+    return page.evaluate(
+        "selectors => selectors.find(sel => document.querySelector(sel) !== null) || null", PRODUCT_SELECTORS
+    ) or ANY_PRODUCT_SELECTOR
+
+
+# Reads every card of the first matching selector in a single round trip.
+# The image is looked up in the card, then in its parent element.
+BULK_EXTRACT_SCRIPT = """
+selectors => {
+    for (const sel of selectors) {
+        const cards = document.querySelectorAll(sel);
+        if (cards.length === 0) continue;
+        return {
+            selector: sel,
+            cards: Array.from(cards, card => {
+                let img = card.querySelector('img');
+                if (!img && card.parentElement) img = card.parentElement.querySelector('img');
+                return {
+                    href: card.getAttribute('href'),
+                    img_src: img ? (img.getAttribute('src') || img.getAttribute('data-src') || img.getAttribute('data-lazy')) : null,
+                    title: img ? (img.getAttribute('title') || img.getAttribute('alt')) : null,
+                    text: card.textContent
+                };
+            })
+        };
     }
+    return {selector: null, cards: []};
+}
+"""
+
+
+def _extract_cards_bulk(page):
+    """
+    Extract href, image URL and title of all product cards with one page.evaluate.
+
+    Returns:
+        Tuple (raw_cards, selector)
+    """
+    data = page.evaluate(BULK_EXTRACT_SCRIPT, PRODUCT_SELECTORS)
+    return data["cards"], data["selector"]
+
+
+def _extract_cards_handles(page):
+    """
+    Extract product cards one element handle at a time (several round trips per card).
+
+    Returns:
+        Tuple (raw_cards, selector)
+    """
+    for selector in PRODUCT_SELECTORS:
+        product_cards = page.query_selector_all(selector)
+        if len(product_cards) > 0:
+            break
+    else:
+        return [], None
+
+    raw_cards = []
+    for card in product_cards:
+        try:
+            href = card.get_attribute("href")
+
+            # Find image - check the card and its children
+            img = card.query_selector("img")
+            if not img and href:
+                # Look for image in parent or sibling elements
+                parent = card.evaluate("el => el.parentElement")
+                if parent:
+                    img = page.query_selector(f"xpath=//a[@href='{href}']/..//img")
+
+            raw_cards.append({
+                "href": href,
+                "img_src": (img.get_attribute("src") or img.get_attribute("data-src") or img.get_attribute("data-lazy")) if img else None,
+                "title": (img.get_attribute("title") or img.get_attribute("alt")) if img else None,
+                "text": card.text_content()
+            })
+        except Exception as e:
+            print(f"⚠️ Error extracting product: {e}")
+            continue
+
+    return raw_cards, selector
+
+
+def _build_products(raw_cards, url, progress_callback=None):
+    """
+    Turn raw card data into product dictionaries, keeping one product per base name.
+    """
+    products = []
+    seen_names = set()
+    parsed_url = urlparse(url)
+
+    for card in raw_cards:
+        link = card.get("href")
+        img_url = card.get("img_src")
+        if not link or not img_url:
+            continue
+
+        # Make link absolute if relative
+        if link.startswith('/'):
+            link = f"{parsed_url.scheme}://{parsed_url.netloc}{link}"
+        elif not link.startswith('http'):
+            link = url.rstrip('/') + '/' + link.lstrip('/')
+
+        name = card.get("title") or card.get("text") or "Unnamed Product"
+        name = name.strip()
+
+        # Extract base product name (remove color variant after last comma)
+        # E.g., "Varsity Tommy Logo Crewneck Sweatshirt, Misty Plum" -> "Varsity Tommy Logo Crewneck Sweatshirt"
+        base_name = name
+        if ',' in name:
+            # Split on last comma to separate product name from color
+            parts = name.rsplit(',', 1)
+            base_name = parts[0].strip()
+
+        # Only add if we haven't seen this base product name before
+        if base_name and base_name not in seen_names:
+            seen_names.add(base_name)
+            products.append({
+                "name": name[:100],  # Keep full name with color for display
+                "base_name": base_name[:100],  # Store base name for reference
+                "link": link,
+                "img_url": img_url
+            })
+
+            # Update progress every 10 products
+            if progress_callback and len(products) % 10 == 0:
+                progress_callback({"count": len(products), "done": False, "message": f"Extracted {len(products)} products..."})
+
+    return products
@@ -0,0 +1,441 @@
+"""
+Scraper registry: picks the cheapest scraper that can handle a store URL.
+
+Adapters declare which URLs they handle and a relative cost. For each URL
+the registry tries them cheapest first:
+
+- shopify (1): the public products.json API, for known Shopify stores or any
+  store whose /products.json answers a one-product probe
+- sitemap (2): product URLs and images from the store's XML sitemaps, for
+  whole-store searches (bare domain) on stores that list images there
+- static (3): product cards parsed from the server-rendered HTML, when a
+  plain GET of the page already contains them
+- playwright (10): a pooled browser that scrolls the page, for everything else
+
+Probe results are cached per host so only the first search of a store pays
+for detection. Sites can be pinned to an adapter in SITE_ADAPTERS to skip
+probing altogether.
+"""
+import threading
+import time
+from abc import ABC, abstractmethod
+import xml.etree.ElementTree as ElementTree
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse
+
+import requests
+
+from scraper import scrape_us_tommy, _build_products
+from scraper_shopify import parse_shopify_url, scrape_shopify_url
+
+# Known stores and the adapter to use for them, matched on the host or a parent domain
+SITE_ADAPTERS = {
+    "bouldergear.com": "shopify",
+    "allbirds.com": "shopify",
+    "gymshark.com": "shopify",
+    "fashionnova.com": "shopify",
+    # Listing is rendered client-side
+    "tommy.com": "playwright",
+}
+
+# Collection fetched for Shopify URLs without a /collections/<handle> segment;
+# every other Shopify store gets its whole catalog ("all")
+SHOPIFY_DEFAULT_COLLECTIONS = {
+    "bouldergear.com": "womens",
+}
+# Products fetched per Shopify search unless the registry is built with another cap
+# (None for whole collections), so one search cannot crawl and embed a whole store
+SHOPIFY_MAX_PRODUCTS = 50
+
+PROBE_TIMEOUT = 5
+# Cached probe results are trusted for this long
+PROBE_TTL_SECONDS = 24 * 3600
+# Server-rendered pages with fewer product cards are left to the browser
+MIN_STATIC_CARDS = 8
+# Product sitemaps fetched per store
+MAX_SITEMAPS = 20
+
+SITEMAP_NS = {
+    "sm": "http://www.sitemaps.org/schemas/sitemap/0.9",
+    "image": "http://www.google.com/schemas/sitemap-image/1.1",
+}
+
+_probe_session = requests.Session()
+_probe_session.headers["User-Agent"] = (
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+)
+
+
+def normalize_url(url):
+    """Add a scheme to bare domains like "allbirds.com/collections/mens"."""
+    url = url.strip()
+    return url if "://" in url else "https://" + url
+
+
+def _host(url):
+    return urlparse(url).netloc.lower()
+
+
+def _host_matches(host, domain):
+    return host == domain or host.endswith("." + domain)
+
+
+class _ProbeCache:
+    """Thread-safe cache of probe results with a TTL."""
+
+    def __init__(self, ttl=PROBE_TTL_SECONDS):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_or_probe(self, key, probe):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] < self.ttl:
+                return entry[1]
+        value = probe()
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+        return value
+
+
+class ScraperAdapter(ABC):
+    """
+    Base class for scrapers managed by the registry.
+
+    Subclasses set `name` and `cost` and implement `handles(url)` and
+    `scrape(url, progress_callback)`, which returns the usual scraper result
+    dictionary (products, total_cards, unique_products and optional source
+    and complete).
+    """
+
+    name = None
+    cost = 0
+
+    @abstractmethod
+    def handles(self, url):
+        """Return True if this adapter can scrape `url`."""
+
+    @abstractmethod
+    def scrape(self, url, progress_callback=None):
+        """Scrape `url` and return the scraper result dictionary."""
+
+
+class ShopifyJsonAdapter(ScraperAdapter):
+    """
+    Shopify stores via products.json; detected with a one-product probe.
+
+    Args:
+        max_products: Products fetched per scrape (None for the whole collection)
+    """
+
+    name = "shopify"
+    cost = 1
+
+    def __init__(self, max_products=SHOPIFY_MAX_PRODUCTS):
+        self.max_products = max_products
+        self._probes = _ProbeCache()
+
+    def handles(self, url):
+        host = _host(url)
+        if host.endswith(".myshopify.com"):
+            return True
+        return self._probes.get_or_probe(host, lambda: self._probe(host))
+
+    @staticmethod
+    def _probe(host):
+        try:
+            response = _probe_session.get(
+                f"https://{host}/products.json", params={"limit": 1}, timeout=PROBE_TIMEOUT
+            )
+            return response.ok and isinstance(response.json().get("products"), list)
+        except Exception:
+            return False
+
+    @staticmethod
+    def collection(url):
+        """Return the (store, collection handle) a Shopify URL lists."""
+        host = _host(normalize_url(url))
+        default_collection = next(
+            (collection for domain, collection in SHOPIFY_DEFAULT_COLLECTIONS.items() if _host_matches(host, domain)),
+            "all"
+        )
+        return parse_shopify_url(url, default_collection)
+
+    def scrape(self, url, progress_callback=None):
+        _, collection = self.collection(url)
+        return scrape_shopify_url(
+            url, progress_callback=progress_callback, max_products=self.max_products,
+            default_collection=collection
+        )
+
+
+class SitemapAdapter(ScraperAdapter):
+    """
+    Whole-store listings from product sitemaps with image entries.
+
+    Only used for bare store domains: a sitemap lists the entire store, not
+    the collection a page URL points at.
+    """
+
+    name = "sitemap"
+    cost = 2
+
+    def __init__(self):
+        self._probes = _ProbeCache()
+
+    def handles(self, url):
+        if urlparse(url).path.strip("/"):
+            return False
+        host = _host(url)
+        return bool(self._probes.get_or_probe(host, lambda: self._product_sitemaps(host)))
+
+    @staticmethod
+    def _fetch_xml(url):
+        try:
+            response = _probe_session.get(url, timeout=PROBE_TIMEOUT)
+            if not response.ok:
+                return None
+            return ElementTree.fromstring(response.content)
+        except Exception:
+            return None
+
+    def _product_sitemaps(self, host):
+        """URLs of all the store's product sitemaps, or an empty list."""
+        candidates = []
+        try:
+            robots = _probe_session.get(f"https://{host}/robots.txt", timeout=PROBE_TIMEOUT)
+            if robots.ok:
+                candidates = [
+                    line.split(":", 1)[1].strip() for line in robots.text.splitlines()
+                    if line.lower().startswith("sitemap:")
+                ]
+        except Exception:
+            pass
+        candidates = candidates or [f"https://{host}/sitemap.xml"]
+
+        sitemaps = []
+        for candidate in candidates:
+            root = self._fetch_xml(candidate)
+            if root is None:
+                continue
+            if root.tag.endswith("sitemapindex"):
+                sitemaps.extend(
+                    loc.text.strip() for loc in root.findall("sm:sitemap/sm:loc", SITEMAP_NS)
+                    if loc.text and "product" in loc.text.lower()
+                )
+            elif root.find("sm:url/image:image", SITEMAP_NS) is not None:
+                sitemaps.append(candidate)
+        return sitemaps
+
+    def scrape(self, url, progress_callback=None):
+        host = _host(url)
+        products = []
+        seen_links = set()
+        sitemaps = self._probes.get_or_probe(host, lambda: self._product_sitemaps(host))
+        # Products in skipped or unreadable sitemaps are unseen, not deleted
+        complete = len(sitemaps) <= MAX_SITEMAPS
+        for sitemap_url in sitemaps[:MAX_SITEMAPS]:
+            root = self._fetch_xml(sitemap_url)
+            if root is None:
+                complete = False
+                continue
+            for entry in root.findall("sm:url", SITEMAP_NS):
+                link = entry.findtext("sm:loc", default="", namespaces=SITEMAP_NS).strip()
+                img_url = entry.findtext("image:image/image:loc", default="", namespaces=SITEMAP_NS).strip()
+                if not link or not img_url or link in seen_links:
+                    continue
+                seen_links.add(link)
+                name = entry.findtext("image:image/image:title", default="", namespaces=SITEMAP_NS).strip()
+                if not name:
+                    name = urlparse(link).path.rstrip("/").rsplit("/", 1)[-1].replace("-", " ").title()
+                products.append({"name": name[:100], "link": link, "img_url": img_url})
+
+            if progress_callback:
+                progress_callback({
+                    "count": len(products),
+                    "done": False,
+                    "message": f"Read {len(products)} products from sitemaps..."
+                })
+
+        print(f"🗺️ Sitemaps of {host}: {len(products)} products")
+        if progress_callback:
+            progress_callback({
+                "count": len(products),
+                "done": True,
+                "message": f"Complete! Found {len(products)} products in {host} sitemaps"
+            })
+        return {
+            "products": products,
+            "total_cards": len(products),
+            "unique_products": len(products),
+            "source": f"{host}/sitemap",
+            "complete": complete
+        }
+
+
+class _ProductCardParser(HTMLParser):
+    """Collect links that wrap an image, the HTML equivalent of a product card."""
+
+    def __init__(self):
+        super().__init__()
+        self.cards = []
+        self._card = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "a" and attrs.get("href"):
+            self._card = {"href": attrs["href"], "img_src": None, "title": None, "text": ""}
+        elif tag == "img" and self._card is not None and not self._card["img_src"]:
+            self._card["img_src"] = attrs.get("src") or attrs.get("data-src") or attrs.get("data-lazy")
+            self._card["title"] = attrs.get("title") or attrs.get("alt")
+
+    def handle_data(self, data):
+        if self._card is not None:
+            self._card["text"] += data
+
+    def handle_endtag(self, tag):
+        if tag == "a" and self._card is not None:
+            if self._card["img_src"] and "product" in self._card["href"].lower():
+                self.cards.append(self._card)
+            self._card = None
+
+
+class StaticHtmlAdapter(ScraperAdapter):
+    """Server-rendered listings parsed from a single GET, without a browser."""
+
+    name = "static"
+    cost = 3
+
+    def __init__(self, min_cards=MIN_STATIC_CARDS):
+        self.min_cards = min_cards
+        self._probes = _ProbeCache()
+
+    @staticmethod
+    def _fetch_cards(url):
+        response = _probe_session.get(url, timeout=15)
+        response.raise_for_status()
+        parser = _ProductCardParser()
+        parser.feed(response.text)
+        for card in parser.cards:
+            card["href"] = urljoin(url, card["href"])
+            card["img_src"] = urljoin(url, card["img_src"])
+        return parser.cards
+
+    def handles(self, url):
+        def probe():
+            try:
+                return len(self._fetch_cards(url)) >= self.min_cards
+            except Exception:
+                return False
+        return self._probes.get_or_probe(url, probe)
+
+    def scrape(self, url, progress_callback=None):
+        raw_cards = self._fetch_cards(url)
+        products = _build_products(raw_cards, url, progress_callback)
+        print(f"📄 Static HTML of {url}: {len(products)} products from {len(raw_cards)} cards")
+        if progress_callback:
+            progress_callback({
+                "count": len(products),
+                "done": True,
+                "message": f"Scraping complete! Found {len(products)} products"
+            })
+        return {
+            "products": products,
+            "total_cards": len(raw_cards),
+            "unique_products": len(products),
+            "source": url,
+            # One page of what may be a paginated listing
+            "complete": False
+        }
+
+
+class PlaywrightDomAdapter(ScraperAdapter):
+    """
+    Pooled browser with infinite scroll; handles any page, at the highest cost.
+
+    Args:
+        capture_mode: "dom" or "network"; None uses each site's profile
+        extractors: Network capture extractors; None uses each site's profile
+    """
+
+    name = "playwright"
+    cost = 10
+
+    def __init__(self, capture_mode=None, extractors=None):
+        self.capture_mode = capture_mode
+        self.extractors = extractors
+
+    def handles(self, url):
+        return urlparse(url).scheme in ("http", "https")
+
+    def scrape(self, url, progress_callback=None):
+        return scrape_us_tommy(
+            url, progress_callback=progress_callback, capture_mode=self.capture_mode, extractors=self.extractors
+        )
+
+
+class ScraperRegistry:
+    """
+    Resolve store URLs to the cheapest adapter that handles them.
+
+    Args:
+        adapters: ScraperAdapter instances
+        site_adapters: Mapping of domain to adapter name for known sites
+    """
+
+    def __init__(self, adapters=(), site_adapters=None):
+        self._adapters = {}
+        self.site_adapters = dict(site_adapters or {})
+        for adapter in adapters:
+            self.register(adapter)
+
+    def register(self, adapter):
+        self._adapters[adapter.name] = adapter
+
+    def pin(self, domain, adapter_name):
+        """Always use `adapter_name` for `domain` and its subdomains."""
+        if adapter_name not in self._adapters:
+            raise ValueError(f"Unknown scraper: {adapter_name}")
+        self.site_adapters[domain] = adapter_name
+
+    def resolve(self, url):
+        """
+        Return the adapter to use for `url`.
+
+        Raises:
+            ValueError: If no adapter handles the URL
+        """
+        url = normalize_url(url)
+        host = _host(url)
+        for domain, adapter_name in self.site_adapters.items():
+            if _host_matches(host, domain) and adapter_name in self._adapters:
+                return self._adapters[adapter_name]
+
+        for adapter in sorted(self._adapters.values(), key=lambda a: a.cost):
+            if adapter.handles(url):
+                return adapter
+        raise ValueError(f"No scraper can handle {url}")
+
+    def scrape(self, url, progress_callback=None):
+        """
+        Scrape `url` with the cheapest suitable adapter.
+
+        Returns:
+            The adapter's result dictionary, plus the adapter name as "scraper"
+        """
+        url = normalize_url(url)
+        adapter = self.resolve(url)
+        print(f"🧩 Using {adapter.name} scraper for {url}")
+        result = adapter.scrape(url, progress_callback=progress_callback)
+        result["scraper"] = adapter.name
+        return result
+
+
+def default_registry(shopify_max_products=SHOPIFY_MAX_PRODUCTS):
+    """Registry with all built-in adapters and the known sites pinned."""
+    return ScraperRegistry(
+        [ShopifyJsonAdapter(max_products=shopify_max_products), SitemapAdapter(), StaticHtmlAdapter(), PlaywrightDomAdapter()],
+        site_adapters=SITE_ADAPTERS
+    )
@@ -6,8 +6,154 @@ Perfect for demos - real products from real stores.
 Works with: Boulder Gear, Allbirds, Gymshark, Fashion Nova, and thousands more Shopify stores.
 """
 
+import math
 import requests
 import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Shopify caps products.json at 250 products per page
+SHOPIFY_PAGE_LIMIT = 250
+
+
+def _make_session():
+    """Pooled session that retries with backoff on rate limits and server errors."""
+    session = requests.Session()
+    retry = Retry(
+        total=5,
+        backoff_factor=1,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        respect_retry_after_header=True
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=8, pool_maxsize=8)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_session = _make_session()
+
+
+def _normalize_store_url(store_url):
+    return store_url.replace("https://", "").replace("http://", "").split("/")[0]
+
+
+def _collection_endpoint(store_url, collection):
+    """Shopify JSON API endpoint for a collection."""
+    if collection == "all":
+        return f"https://{store_url}/products.json"
+    return f"https://{store_url}/collections/{collection}/products.json"
+
+
+def shopify_source(store_url, collection):
+    """Canonical store/collection identifier reported as a scrape's "source"."""
+    return f"{_normalize_store_url(store_url)}/collections/{collection}"
+
+
+def _fetch_page(url, page, limit):
+    response = _session.get(url, params={"limit": limit, "page": page}, timeout=15)
+    response.raise_for_status()
+    return response.json().get('products', [])
+
+
+def _parse_product(item, store_url):
+    """
+    Convert a Shopify product JSON object into our product dictionary.
+
+    Returns None if the product has no image.
+    """
+    # Extract product info
+    title = item.get('title', 'Unnamed Product')
+    handle = item.get('handle', '')
+    product_url = f"https://{store_url}/products/{handle}"
+
+    # Get first variant for price
+    variants = item.get('variants', [])
+    price = None
+    if variants:
+        price = variants[0].get('price')
+
+    # Get first image
+    images = item.get('images', [])
+    img_url = None
+    if images:
+        img_url = images[0].get('src')
+
+    # Skip if no image
+    if not img_url:
+        return None
+
+    return {
+        "id": item.get('id'),
+        "name": title[:100],
+        "link": product_url,
+        "img_url": img_url,
+        "price": f"${price}" if price else None,
+        "updated_at": item.get('updated_at')
+    }
+
+
+def iter_shopify_products(store_url, collection="womens", max_products=None, page_workers=4):
+    """
+    Stream products from a Shopify collection, following pagination.
+
+    Pages of `products.json` are fetched `page_workers` at a time and yielded
+    in page order as soon as they arrive, until an empty or partial page
+    marks the end of the collection.
+
+    Args:
+        store_url: Store domain (e.g., "bouldergear.com")
+        collection: Collection handle, or "all" for all products
+        max_products: Stop after this many products (None for the whole collection)
+        page_workers: Number of pages fetched concurrently
+
+    Yields:
+        Product dictionaries with id, name, link, img_url, price and updated_at
+    """
+    store_url = _normalize_store_url(store_url)
+    url = _collection_endpoint(store_url, collection)
+    limit = SHOPIFY_PAGE_LIMIT if max_products is None else min(max_products, SHOPIFY_PAGE_LIMIT)
+
+    yielded = 0
+    next_page = 1
+    executor = ThreadPoolExecutor(max_workers=page_workers)
+    try:
+        while True:
+            batch = page_workers
+            if max_products is not None:
+                # No more pages than the remaining products can fill; the API rate-limits
+                batch = min(batch, math.ceil((max_products - yielded) / limit))
+            pages = range(next_page, next_page + batch)
+            futures = [executor.submit(_fetch_page, url, page, limit) for page in pages]
+            next_page += batch
+
+            for page, future in zip(pages, futures):
+                items = future.result()
+                print(f"📄 Page {page}: {len(items)} products")
+
+                for item in items:
+                    try:
+                        product = _parse_product(item, store_url)
+                    except Exception as e:
+                        print(f"⚠️ Error processing product: {e}")
+                        continue
+                    if product is None:
+                        continue
+
+                    yield product
+                    yielded += 1
+                    if max_products is not None and yielded >= max_products:
+                        return
+
+                # A short page is the last one
+                if len(items) < limit:
+                    return
+    finally:
+        # Drop page fetches nobody will read (last page reached, cap hit or the
+        # consumer stopped iterating) instead of waiting for them
+        executor.shutdown(wait=False, cancel_futures=True)
 
 
 def scrape_shopify_collection(store_url, collection="womens", max_products=50, progress_callback=None):
@@ -18,21 +164,23 @@ def scrape_shopify_collection(store_url, collection="womens", max_products=50, p
         store_url: Store domain (e.g., "bouldergear.com", "allbirds.com")
         collection: Collection handle (e.g., "womens", "mens", "new-arrivals")
                    Use "all" for all products
-        max_products: Maximum number of products to fetch (default: 50)
+        max_products: Maximum number of products to fetch (default: 50, None for the whole collection)
         progress_callback: Optional callback for progress updates
 
     Returns:
-        Dictionary with products, total_cards, and unique_products
+        Dictionary with products, total_cards, unique_products, source
+        (canonical store/collection identifier) and complete (False when
+        the listing was capped or cut short)
     """
     products = []
 
     try:
         # Normalize store URL
-        store_url = store_url.replace("https://", "").replace("http://", "").split("/")[0]
+        store_url = _normalize_store_url(store_url)
 
         print(f"🚀 Fetching products from Shopify store: {store_url}")
         print(f"   Collection: {collection}")
-        print(f"   Max products: {max_products}")
+        print(f"   Max products: {max_products or 'all'}")
 
         if progress_callback:
             progress_callback({
@@ -41,74 +189,25 @@ def scrape_shopify_collection(store_url, collection="womens", max_products=50, p
                 "message": f"Connecting to {store_url}..."
             })
 
-        # Shopify JSON API endpoint
-        if collection == "all":
-            url = f"https://{store_url}/products.json"
-        else:
-            url = f"https://{store_url}/collections/{collection}/products.json"
-
-        # Add limit parameter (max 250 per Shopify)
-        params = {"limit": min(max_products, 250)}
-
-        print(f"📡 Making API request to: {url}")
-        response = requests.get(url, params=params, timeout=15)
-        response.raise_for_status()
+        print(f"📡 Making API requests to: {_collection_endpoint(store_url, collection)}")
+        try:
+            for product in iter_shopify_products(store_url, collection, max_products=max_products):
+                products.append(product)
 
-        data = response.json()
-        shopify_products = data.get('products', [])
-
-        print(f"✅ API Response received!")
-        print(f"   Found {len(shopify_products)} products")
-
-        if progress_callback:
-            progress_callback({
-                "count": len(shopify_products),
-                "done": False,
-                "message": f"Processing {len(shopify_products)} products..."
-            })
-
-        # Process products
-        for idx, item in enumerate(shopify_products):
-            try:
-                # Extract product info
-                title = item.get('title', 'Unnamed Product')
-                handle = item.get('handle', '')
-                product_url = f"https://{store_url}/products/{handle}"
-
-                # Get first variant for price
-                variants = item.get('variants', [])
-                price = None
-                if variants:
-                    price = variants[0].get('price')
-
-                # Get first image
-                images = item.get('images', [])
-                img_url = None
-                if images:
-                    img_url = images[0].get('src')
-
-                # Skip if no image
-                if not img_url:
-                    continue
-
-                products.append({
-                    "name": title[:100],
-                    "link": product_url,
-                    "img_url": img_url,
-                    "price": f"${price}" if price else None
-                })
-
-                # Progress update every 5 products
-                if progress_callback and (idx + 1) % 5 == 0:
+                # Progress update every 50 products
+                if progress_callback and len(products) % 50 == 0:
                     progress_callback({
                         "count": len(products),
                         "done": False,
-                        "message": f"Processed {len(products)} products..."
+                        "message": f"Fetched {len(products)} products..."
                     })
-
-            except Exception as e:
-                print(f"⚠️ Error processing product: {e}")
-                continue
+            complete = max_products is None or len(products) < max_products
+        except requests.exceptions.RequestException:
+            if not products:
+                raise
+            # Keep what we have if a later page fails after retries
+            print(f"⚠️ Pagination stopped early after {len(products)} products")
+            complete = False
 
         print(f"\n📊 Shopify API Fetch Summary:")
         print(f"   Products fetched: {len(products)}")
@@ -124,7 +223,9 @@ def scrape_shopify_collection(store_url, collection="womens", max_products=50, p
         return {
             "products": products,
             "total_cards": len(products),
-            "unique_products": len(products)
+            "unique_products": len(products),
+            "source": shopify_source(store_url, collection),
+            "complete": complete
         }
 
     except requests.exceptions.RequestException as e:
@@ -146,58 +247,73 @@ def scrape_shopify_collection(store_url, collection="womens", max_products=50, p
 
 
 # Convenience functions for Boulder Gear
-def scrape_bouldergear_womens(progress_callback=None):
+def scrape_bouldergear_womens(progress_callback=None, max_products=None):
     """Scrape Boulder Gear women's collection"""
     return scrape_shopify_collection(
         store_url="bouldergear.com",
         collection="womens",
-        max_products=50,
+        max_products=max_products,
         progress_callback=progress_callback
     )
 
 
-def scrape_bouldergear_mens(progress_callback=None):
+def scrape_bouldergear_mens(progress_callback=None, max_products=None):
     """Scrape Boulder Gear men's collection"""
     return scrape_shopify_collection(
         store_url="bouldergear.com",
         collection="mens",
-        max_products=50,
+        max_products=max_products,
         progress_callback=progress_callback
     )
 
 
-def scrape_bouldergear_all(progress_callback=None):
+def scrape_bouldergear_all(progress_callback=None, max_products=None):
     """Scrape all Boulder Gear products"""
     return scrape_shopify_collection(
         store_url="bouldergear.com",
         collection="all",
-        max_products=100,
+        max_products=max_products,
         progress_callback=progress_callback
     )
 
 
-# Generic wrapper for any Shopify store
-def scrape_shopify_url(url, progress_callback=None):
+def parse_shopify_url(url, default_collection="womens"):
     """
-    Smart wrapper that extracts store domain and collection from URL.
+    Split a store URL into its domain and collection handle.
 
-    Examples:
-        - "bouldergear.com" → womens collection
-        - "https://bouldergear.com/collections/mens" → mens collection
-        - "allbirds.com/collections/womens-shoes" → womens-shoes collection
+    URLs without a /collections/<handle> segment use `default_collection`.
+
+    Returns:
+        Tuple (store_url, collection)
     """
-    # Parse URL
     url = url.replace("https://", "").replace("http://", "")
     parts = url.split("/")
 
     store_url = parts[0]
-    collection = "womens"  # default
+    collection = default_collection
 
     # Extract collection from URL if present
     if "collections" in parts:
         collection_idx = parts.index("collections")
         if len(parts) > collection_idx + 1:
             collection = parts[collection_idx + 1]
+    return store_url, collection
+
+
+# Generic wrapper for any Shopify store
+def scrape_shopify_url(url, progress_callback=None, max_products=None, default_collection="womens"):
+    """
+    Smart wrapper that extracts store domain and collection from URL.
+
+    URLs without a /collections/<handle> segment use `default_collection`
+    ("all" for the whole store).
+
+    Examples:
+        - "bouldergear.com" → womens collection (the default)
+        - "https://bouldergear.com/collections/mens" → mens collection
+        - "allbirds.com/collections/womens-shoes" → womens-shoes collection
+    """
+    store_url, collection = parse_shopify_url(url, default_collection)
 
     print(f"🔍 Detected Shopify store: {store_url}")
     print(f"   Collection: {collection}")
@@ -205,7 +321,7 @@ def scrape_shopify_url(url, progress_callback=None):
     return scrape_shopify_collection(
         store_url=store_url,
         collection=collection,
-        max_products=50,
+        max_products=max_products,
         progress_callback=progress_callback
     )
 
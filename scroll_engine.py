@@ -0,0 +1,242 @@
+"""
+Infinite-scroll engines for Playwright listing pages.
+
+- scroll_adaptive: waits on actual growth of the product card count instead
+  of sleeping, backs off when nothing loads, jumps straight to the bottom
+  while growth is steady and stops as soon as a known total is reached
+- scroll_fixed: the original loop with fixed sleeps, kept for comparison
+
+Both return the same stats dictionary, including `seconds` (time until the
+last card appeared) and `elapsed` (time until the engine gave up), so the
+two can be compared on the same page, and `complete`, which is False when
+the listing may not have been fully loaded.
+"""
+import re
+import time
+
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+
+# Matches listing totals like "1,410 Products" or "Showing 250 items"
+TOTAL_COUNT_PATTERN = r"([\d][\d,.]*)\s+(?:products|items|results|styles)\b"
+
+COUNT_SCRIPT = "sel => document.querySelectorAll(sel).length"
+GROWTH_SCRIPT = "([sel, n]) => document.querySelectorAll(sel).length > n"
+
+
+# Text of the elements matching a selector (the site's result-count element)
+SELECTOR_TEXT_SCRIPT = "sel => Array.from(document.querySelectorAll(sel), el => el.innerText).join(' ')"
+
+# Stop reasons after which the listing may be only partly loaded
+INCOMPLETE_REASONS = ("time_limit", "max_scrolls")
+
+
+def detect_total_count(page, selector=None, pattern=TOTAL_COUNT_PATTERN):
+    """
+    Read the listing's advertised product total, if any.
+
+    Args:
+        page: Playwright page
+        selector: CSS selector of the site's result-count element; when None
+            the whole page text is searched, which can pick up unrelated
+            numbers (e.g. "3 items" in a mini-cart)
+        pattern: Regex whose first group is the total
+    """
+    try:
+        if selector:
+            text = page.evaluate(SELECTOR_TEXT_SCRIPT, selector)
+        else:
+            text = page.evaluate("document.body ? document.body.innerText : ''")
+    except Exception:
+        return None
+    match = re.search(pattern, text, re.IGNORECASE)
+    if not match:
+        return None
+    try:
+        return int(re.sub(r"[,.]", "", match.group(1)))
+    except ValueError:
+        return None
+
+
+def _count(page, selector):
+    return page.evaluate(COUNT_SCRIPT, selector)
+
+
+def _report_progress(progress_callback, count):
+    if progress_callback:
+        progress_callback({
+            "count": count,
+            "done": False,
+            "message": f"Loading products... ({count} cards loaded)"
+        })
+
+
+def scroll_adaptive(page, selector, expected_total=None, base_wait_ms=1500, max_wait_ms=8000,
+                    max_stale=3, max_seconds=300, progress_callback=None, total_selector=None):
+    """
+    Scroll until no more cards load, waiting on DOM growth instead of fixed sleeps.
+
+    Args:
+        page: Playwright page
+        selector: CSS selector of a product card
+        expected_total: Stop once this many cards are loaded (detected from the page when None)
+        total_selector: CSS selector of the site's result-count element, for detecting
+            the total; without it the whole page text is searched and the result is
+            only a heuristic
+        base_wait_ms: Initial wait for new cards after each scroll
+        max_wait_ms: Upper bound for the wait after repeated stale scrolls
+        max_stale: Stop after this many scrolls in a row without new cards
+        max_seconds: Hard time limit
+        progress_callback: Optional callback for progress updates
+
+    Returns:
+        Dictionary with cards, expected_total, total_source ("given", "selector",
+        "heuristic" or None), scrolls, seconds, elapsed, reason and complete
+        (False after the time limit or when the total was only a heuristic)
+    """
+    start = time.time()
+    count = _count(page, selector)
+    total_source = "given" if expected_total is not None else None
+    if expected_total is None:
+        expected_total = detect_total_count(page, total_selector)
+        # A total below what is already loaded is some other number (e.g. cart items)
+        if expected_total is not None and expected_total <= count:
+            expected_total = None
+        if expected_total:
+            total_source = "selector" if total_selector else "heuristic"
+            print(f"🔢 Page advertises {expected_total} products ({total_source})")
+
+    last_growth_at = time.time()
+    wait_ms = base_wait_ms
+    steady = 0
+    stale = 0
+    scrolls = 0
+    reason = "stale"
+
+    while True:
+        if expected_total and count >= expected_total:
+            reason = "total_reached"
+            break
+        if time.time() - start > max_seconds:
+            reason = "time_limit"
+            break
+
+        # While cards keep arriving, jump to the bottom; otherwise advance one screen
+        if steady >= 2:
+            page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
+        else:
+            page.evaluate("window.scrollBy(0, window.innerHeight)")
+        scrolls += 1
+
+        try:
+            page.wait_for_function(GROWTH_SCRIPT, arg=[selector, count], timeout=wait_ms)
+        except PlaywrightTimeoutError:
+            stale += 1
+            steady = 0
+            if stale >= max_stale:
+                break
+            # Nothing yet: give slow XHRs more time before the next attempt
+            wait_ms = min(wait_ms * 2, max_wait_ms)
+            try:
+                page.wait_for_load_state("networkidle", timeout=wait_ms)
+            except PlaywrightTimeoutError:
+                pass
+            continue
+
+        new_count = _count(page, selector)
+        if new_count // 50 != count // 50:
+            _report_progress(progress_callback, new_count)
+        count = new_count
+        last_growth_at = time.time()
+        stale = 0
+        steady += 1
+        wait_ms = base_wait_ms
+
+    seconds = round(last_growth_at - start, 2)
+    print(f"✅ Loaded {count} cards in {seconds}s after {scrolls} scrolls ({reason})")
+    return {
+        "cards": count,
+        "expected_total": expected_total,
+        "total_source": total_source,
+        "scrolls": scrolls,
+        "seconds": seconds,
+        "elapsed": round(time.time() - start, 2),
+        "reason": reason,
+        # A heuristic total may have stopped the scroll early; don't let callers treat it as the full listing
+        "complete": reason not in INCOMPLETE_REASONS and total_source != "heuristic",
+    }
+
+
+def scroll_fixed(page, selector, max_scrolls=100, max_stale=10, progress_callback=None, total_selector=None):
+    """
+    Original scroll loop: three 500px steps with fixed sleeps per iteration,
+    stopping after `max_stale` iterations without new cards.
+    `total_selector` is accepted for interface parity and ignored.
+
+    Returns:
+        Dictionary with cards, expected_total, total_source, scrolls, seconds,
+        elapsed, reason and complete
+    """
+    start = time.time()
+    last_growth_at = start
+    previous_product_count = 0
+    scroll_attempts = 0
+    no_new_products_count = 0
+    current_product_count = 0
+    reason = "max_scrolls"
+
+    while scroll_attempts < max_scrolls:
+        # Scroll to bottom in multiple steps (more realistic)
+        for _ in range(3):
+            page.evaluate("window.scrollBy(0, 500)")
+            time.sleep(0.5)
+
+        # Wait for lazy loading
+        time.sleep(2)
+
+        # Check current product count
+        current_product_count = _count(page, selector)
+
+        # Progress update
+        if current_product_count != previous_product_count:
+            print(f"  Scroll #{scroll_attempts + 1}: {current_product_count} product cards loaded")
+            no_new_products_count = 0
+            last_growth_at = time.time()
+
+            if current_product_count % 50 == 0:
+                _report_progress(progress_callback, current_product_count)
+        else:
+            no_new_products_count += 1
+
+        # Stop if no new products for max_stale consecutive scrolls
+        if no_new_products_count >= max_stale:
+            reason = "stale"
+            break
+
+        previous_product_count = current_product_count
+        scroll_attempts += 1
+
+        # Wait for network to settle occasionally
+        if scroll_attempts % 5 == 0:
+            try:
+                page.wait_for_load_state("networkidle", timeout=3000)
+            except PlaywrightTimeoutError:
+                pass
+
+    seconds = round(last_growth_at - start, 2)
+    print(f"✅ Loaded {current_product_count} cards in {seconds}s after {scroll_attempts} scrolls ({reason})")
+    return {
+        "cards": current_product_count,
+        "expected_total": None,
+        "total_source": None,
+        "scrolls": scroll_attempts,
+        "seconds": seconds,
+        "elapsed": round(time.time() - start, 2),
+        "reason": reason,
+        "complete": reason not in INCOMPLETE_REASONS,
+    }
+
+
+SCROLL_MODES = {
+    "adaptive": scroll_adaptive,
+    "fixed": scroll_fixed,
+}
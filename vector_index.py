@@ -0,0 +1,253 @@
+"""
+Vector indexes for first-stage product retrieval.
+
+Both indexes store one vector per product and rank by inner product:
+- FlatIndex: exact brute-force scan, best for small catalogs
+- IVFIndex: inverted-file index (k-means partitions, NumPy only) that only
+  scans the partitions closest to the query, for large multi-store catalogs
+
+Stored vectors are the mean of a product's multi-scale view embeddings. The
+inner product of two such means equals the average of the 9 pairwise view
+similarities, i.e. the `avg_sim` term of compute_advanced_similarity, which
+makes it a good cheap proxy before full re-scoring.
+"""
+import threading
+
+import numpy as np
+
+from atomic_file import atomic_open
+
+
+class FlatIndex:
+    """
+    Exact inner-product index over all stored vectors.
+
+    Thread-safe: searches (which may train an IVF index) and updates
+    serialize on the index's own lock.
+    """
+
+    kind = "flat"
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.ids = []
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self._rows = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, item_id):
+        return item_id in self._rows
+
+    def add(self, ids, vectors):
+        """Add vectors under the given ids, replacing any existing entries."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.dim)
+        with self._lock:
+            existing = [i for i in ids if i in self._rows]
+            if existing:
+                self.remove(existing)
+
+            start = len(self.ids)
+            self.ids.extend(ids)
+            self.vectors = np.concatenate([self.vectors, vectors])
+            for offset, item_id in enumerate(ids):
+                self._rows[item_id] = start + offset
+            self._on_add(vectors)
+
+    def remove(self, ids):
+        """Remove the given ids; unknown ids are ignored."""
+        with self._lock:
+            rows = [self._rows[i] for i in ids if i in self._rows]
+            if not rows:
+                return
+            keep = np.ones(len(self.ids), dtype=bool)
+            keep[rows] = False
+            self.ids = [item_id for item_id, k in zip(self.ids, keep) if k]
+            self.vectors = self.vectors[keep]
+            self._rows = {item_id: row for row, item_id in enumerate(self.ids)}
+            self._on_remove(keep)
+
+    def search(self, query, k=10):
+        """
+        Return the `k` best matches for a query vector.
+
+        Returns:
+            List of (id, score) tuples sorted by descending score
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        with self._lock:
+            if not self.ids:
+                return []
+            rows = self._candidate_rows(query, k)
+            scores = self.vectors[rows] @ query
+            return self._top_k(rows, scores, k)
+
+    def _candidate_rows(self, query, k):
+        return np.arange(len(self.ids))
+
+    def _top_k(self, rows, scores, k):
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(self.ids[rows[i]], float(scores[i])) for i in best]
+
+    def _on_add(self, vectors):
+        pass
+
+    def _on_remove(self, keep):
+        pass
+
+    def _state(self):
+        return {}
+
+    def _load_state(self, data):
+        pass
+
+    def save(self, path):
+        """Persist the index to a `.npz` file."""
+        # EmbeddingCatalog.save calls this outside its publish lock
+        with self._lock, atomic_open(path, "wb") as f:
+            np.savez(
+                f,
+                kind=np.array(self.kind),
+                dim=np.array(self.dim),
+                ids=np.array(self.ids, dtype=str),
+                vectors=self.vectors,
+                **self._state()
+            )
+
+    @classmethod
+    def load(cls, path):
+        """Load an index saved with `save`, returning the right index type."""
+        with np.load(path, allow_pickle=False) as data:
+            kind = str(data["kind"])
+            index = INDEX_TYPES[kind](int(data["dim"]))
+            index.ids = [str(i) for i in data["ids"]]
+            index.vectors = data["vectors"].astype(np.float32)
+            index._rows = {item_id: row for row, item_id in enumerate(index.ids)}
+            index._load_state(data)
+        return index
+
+
+class IVFIndex(FlatIndex):
+    """
+    Inverted-file index: vectors are partitioned with k-means and a query
+    scans the partitions whose centroids score highest: at least `n_probe`,
+    and more until `candidate_factor` x k vectors have been collected, so
+    recall holds up as the number of partitions grows with the index.
+
+    The index trains itself on first search once it holds at least
+    `min_train_size` vectors; smaller indexes are scanned exhaustively.
+
+    Args:
+        dim: Vector dimension
+        n_lists: Number of partitions (default: ~sqrt of the index size)
+        n_probe: Minimum number of partitions scanned per query
+        min_train_size: Minimum number of vectors before partitioning
+        candidate_factor: Vectors scanned per query, as a multiple of k
+    """
+
+    kind = "ivf"
+
+    def __init__(self, dim, n_lists=None, n_probe=8, min_train_size=1000, candidate_factor=4):
+        super().__init__(dim)
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.candidate_factor = candidate_factor
+        self.min_train_size = min_train_size
+        self.centroids = None
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self._trained_size = 0
+
+    def train(self, n_iter=15, seed=0):
+        """Partition the stored vectors with spherical k-means."""
+        with self._lock:
+            self._train(n_iter, seed)
+
+    def _train(self, n_iter, seed):
+        n_lists = self.n_lists or max(1, int(np.sqrt(len(self.ids))))
+        n_lists = min(n_lists, len(self.ids))
+        data = self.vectors / np.maximum(np.linalg.norm(self.vectors, axis=1, keepdims=True), 1e-12)
+
+        rng = np.random.default_rng(seed)
+        centroids = data[rng.choice(len(data), n_lists, replace=False)]
+        for _ in range(n_iter):
+            assignments = np.argmax(data @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = data[assignments == c]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[c] = centroid / max(np.linalg.norm(centroid), 1e-12)
+
+        self.centroids = centroids.astype(np.float32)
+        self.assignments = np.argmax(data @ self.centroids.T, axis=1).astype(np.int32)
+        self._trained_size = len(self.ids)
+
+    def _assign(self, vectors):
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def _on_add(self, vectors):
+        if self.centroids is not None:
+            self.assignments = np.concatenate([self.assignments, self._assign(vectors)])
+
+    def _on_remove(self, keep):
+        if self.centroids is not None:
+            self.assignments = self.assignments[keep]
+
+    def _candidate_rows(self, query, k):
+        if self.centroids is None or len(self.ids) > 2 * self._trained_size:
+            if len(self.ids) < self.min_train_size:
+                return np.arange(len(self.ids))
+            # (Re)partition once the index has doubled since the last training
+            self.train()
+        # Visit partitions best first until enough vectors are collected
+        order = np.argsort(-(self.centroids @ query))
+        sizes = np.bincount(self.assignments, minlength=len(self.centroids))[order]
+        needed = np.searchsorted(np.cumsum(sizes), self.candidate_factor * k) + 1
+        probe = min(max(self.n_probe, needed), len(order))
+        return np.flatnonzero(np.isin(self.assignments, order[:probe]))
+
+    def _state(self):
+        state = {
+            # 0 stands for None (partitions sized from the index)
+            "n_lists": np.array(self.n_lists or 0),
+            "n_probe": np.array(self.n_probe),
+            "min_train_size": np.array(self.min_train_size),
+            "candidate_factor": np.array(self.candidate_factor),
+        }
+        if self.centroids is not None:
+            state.update(
+                centroids=self.centroids,
+                assignments=self.assignments,
+                trained_size=np.array(self._trained_size),
+            )
+        return state
+
+    def _load_state(self, data):
+        self.n_probe = int(data["n_probe"])
+        # Indexes saved before these were persisted keep the defaults
+        if "n_lists" in data:
+            self.n_lists = int(data["n_lists"]) or None
+            self.min_train_size = int(data["min_train_size"])
+            self.candidate_factor = float(data["candidate_factor"])
+        if "centroids" in data:
+            self.centroids = data["centroids"]
+            self.assignments = data["assignments"]
+            self._trained_size = int(data["trained_size"]) if "trained_size" in data else len(self.ids)
+
+
+INDEX_TYPES = {
+    FlatIndex.kind: FlatIndex,
+    IVFIndex.kind: IVFIndex,
+}
+
+
+def make_index(kind, dim, **kwargs):
+    """Create an empty index of the given kind ("flat" or "ivf")."""
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown index kind: {kind}")
+    return INDEX_TYPES[kind](dim, **kwargs)